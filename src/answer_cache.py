@@ -0,0 +1,114 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of full RAG responses looked up by query-embedding similarity.
+
+    Entries are bucketed by a settings key (domain, rag type, LLM, retrieval
+    settings...) and only match within the same bucket when their cosine
+    similarity is >= threshold. Each entry remembers the index generation it
+    was produced under; once the index changes every older entry is dropped.
+    Entries expire after ttl_seconds and the least recently used are evicted
+    past max_entries.
+    """
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 512):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[Hashable, Dict[str, Any]] = {}  # key -> {"ids": [...], "matrix": ndarray | None}
+        self._generation = None
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_generation(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._buckets.clear()
+            self._generation = generation
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        bucket = self._buckets.get(entry["key"])
+        if bucket is not None:
+            bucket["ids"].remove(entry_id)
+            bucket["matrix"] = None
+            if not bucket["ids"]:
+                del self._buckets[entry["key"]]
+
+    def lookup(self, embedding: List[float], key: Hashable, generation) -> Optional[Dict[str, Any]]:
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._sync_generation(generation)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self.misses += 1
+                return None
+
+            for entry_id in [i for i in bucket["ids"] if now - self._entries[i]["created"] > self.ttl_seconds]:
+                self._remove(entry_id)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self.misses += 1
+                return None
+
+            if bucket["matrix"] is None:
+                bucket["matrix"] = np.vstack([self._entries[i]["vector"] for i in bucket["ids"]])
+            scores = bucket["matrix"] @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = bucket["ids"][best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id]["response"]
+
+    def store(self, embedding: List[float], key: Hashable, generation, response: Dict[str, Any]):
+        with self._lock:
+            self._sync_generation(generation)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "key": key,
+                "vector": self._normalize(embedding),
+                "response": response,
+                "created": time.time(),
+            }
+            bucket = self._buckets.setdefault(key, {"ids": [], "matrix": None})
+            bucket["ids"].append(entry_id)
+            bucket["matrix"] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, int | float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,302 @@
+"""
+Micro-benchmarks for the ingestion and query paths.
+
+Run from the repository root (paths like data/cache are relative to it), e.g.:
+    python src/benchmark.py ingest
+"""
+import sys
+import time
+import json
+import hashlib
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from db import Database
+
+
+def bench_bulk_ingest(sizes=(10_000, 100_000, 1_000_000), batch_size=2000, dim=8):
+    """
+    Per-batch cost of Database.add_to_db as the collection grows.
+    A tiny fake embedding keeps the numbers about bookkeeping, not embedding.
+    Expect the per-batch time to stay flat from the first checkpoint to the last.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(DeterministicFakeEmbedding(size=dim), tmp, cache_dir=tmp)
+        total = 0
+        rows = []
+        for size in sorted(sizes):
+            while total < size:
+                n = min(batch_size, size - total)
+                chunks = [
+                    Document(page_content=f"chunk {total + i}", metadata={"source": f"bench_{(total + i) // 500}"})
+                    for i in range(n)
+                ]
+                start = time.perf_counter()
+                db.add_to_db(chunks)
+                elapsed = time.perf_counter() - start
+                total += n
+            rows.append((size, elapsed * 1000))
+            print(f"{size:>10,} chunks | last batch of {batch_size}: {elapsed * 1000:8.1f} ms")
+        return rows
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the Ollama HTTP API (/api/embed and streaming /api/chat)
+    with a fixed per-token delay, so concurrency can be measured without a GPU.
+    """
+    token_delay = 0.02
+    answer_tokens = 20
+    dim = 16
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _vector(self, text: str):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255.0 for b in digest[:self.dim]]
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == "/api/embed":
+            inputs = body.get("input")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            payload = {"model": body.get("model"), "embeddings": [self._vector(t) for t in inputs]}
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if self.path == "/api/chat":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for i in range(self.answer_tokens):
+                time.sleep(self.token_delay)
+                line = {"model": body.get("model"), "created_at": "2024-01-01T00:00:00Z",
+                        "message": {"role": "assistant", "content": f"tok{i} "}, "done": False}
+                self.wfile.write((json.dumps(line) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            final = {"model": body.get("model"), "created_at": "2024-01-01T00:00:00Z",
+                     "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop"}
+            self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+            return
+
+        self.send_response(404)
+        self.end_headers()
+
+
+def start_fake_ollama():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_async_concurrency(num_queries=16, num_docs=200):
+    """
+    Sequential Rag-style invoke() vs. asyncio.gather over ainvoke() against a
+    local fake Ollama server. Expect the async wall-clock to approach a single
+    query's latency while the sync path grows linearly with num_queries.
+    """
+    from langchain_ollama import ChatOllama, OllamaEmbeddings
+    from chain import simple_rag_chain
+    from retriever import DomainRetriever
+    from router import ManualDomainRouter
+
+    server, base_url = start_fake_ollama()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            embed = OllamaEmbeddings(model="fake-embed", base_url=base_url)
+            db = Database(embed, tmp, cache_dir=tmp)
+            db.add([Document(page_content=f"document {i} about topic {i % 17}", metadata={"source": f"doc_{i // 20}"})
+                    for i in range(num_docs)])
+
+            llm = ChatOllama(model="fake-llm", base_url=base_url)
+            retriever = DomainRetriever(db=db, router=ManualDomainRouter(), k=5, threshold=0.0)
+            chain = simple_rag_chain(llm, retriever)
+            queries = [f"question number {i}" for i in range(num_queries)]
+
+            start = time.perf_counter()
+            for q in queries:
+                chain.invoke(q)
+            sync_elapsed = time.perf_counter() - start
+
+            async def run_all():
+                return await asyncio.gather(*(chain.ainvoke(q) for q in queries))
+
+            db.clear_query_cache()
+            start = time.perf_counter()
+            asyncio.run(run_all())
+            async_elapsed = time.perf_counter() - start
+
+            print(f"{num_queries} queries | sync: {sync_elapsed:.2f}s ({num_queries / sync_elapsed:.1f} q/s) "
+                  f"| async: {async_elapsed:.2f}s ({num_queries / async_elapsed:.1f} q/s)")
+            return {"sync_seconds": sync_elapsed, "async_seconds": async_elapsed}
+    finally:
+        server.shutdown()
+
+
+def _sample_rerank_candidates(num_candidates=20, seed=0):
+    """(query, [chunk texts]) pairs built from data/test_queries.json and the conversion cache."""
+    import random
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+    chunks = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # conversion records and any legacy JSON files, read the way ingestion reads them
+        db = Database(DeterministicFakeEmbedding(size=8), tmp, cache_dir="data/cache")
+        for cache_file in db._list_cache_files():
+            chunks.extend(splitter.split_text(db.read_cached_document(cache_file).page_content))
+    queries = [q["query"] for q in json.loads(Path("data/test_queries.json").read_text(encoding="utf-8"))]
+
+    rng = random.Random(seed)
+    return [(q, rng.sample(chunks, min(num_candidates, len(chunks)))) for q in queries]
+
+
+def bench_onnx_reranker(num_candidates=20, top_n=5, batch_size=32, num_threads=None):
+    """
+    Latency of the PyTorch cross-encoder vs. the int8 ONNX export on the same
+    candidates, plus how closely the two rankings agree (top-n overlap and
+    Spearman correlation of the scores).
+    """
+    from model_pool import cross_encoder_pool
+    from enum_manager import RERANKER
+
+    model_name = RERANKER.MACRO_MINI.value
+    backends = {
+        "torch": cross_encoder_pool.get(model_name),
+        "onnx_int8": cross_encoder_pool.get(model_name, {"batch_size": batch_size, "num_threads": num_threads}, backend="onnx_int8"),
+    }
+    samples = _sample_rerank_candidates(num_candidates)
+
+    timings = {name: [] for name in backends}
+    scores = {name: [] for name in backends}
+    for query, candidates in samples:
+        pairs = [(query, c) for c in candidates]
+        for name, model in backends.items():
+            start = time.perf_counter()
+            scores[name].append([float(s) for s in model.score(pairs)])
+            timings[name].append(time.perf_counter() - start)
+
+    def ranks(values):
+        order = sorted(range(len(values)), key=lambda i: values[i], reverse=True)
+        result = [0] * len(values)
+        for rank, i in enumerate(order):
+            result[i] = rank
+        return result
+
+    overlaps, spearman = [], []
+    for ref, fast in zip(scores["torch"], scores["onnx_int8"]):
+        r_ref, r_fast = ranks(ref), ranks(fast)
+        top_ref = {i for i, r in enumerate(r_ref) if r < top_n}
+        top_fast = {i for i, r in enumerate(r_fast) if r < top_n}
+        overlaps.append(len(top_ref & top_fast) / max(1, len(top_ref)))
+        n = len(ref)
+        d2 = sum((a - b) ** 2 for a, b in zip(r_ref, r_fast))
+        spearman.append(1 - 6 * d2 / (n * (n * n - 1)) if n > 1 else 1.0)
+
+    for name, values in timings.items():
+        values = sorted(values)
+        print(f"{name:>10} | mean {1000 * sum(values) / len(values):7.1f} ms | p50 {1000 * values[len(values) // 2]:7.1f} ms "
+              f"for {num_candidates} candidates")
+    print(f"top-{top_n} overlap: {sum(overlaps) / len(overlaps):.3f} | spearman: {sum(spearman) / len(spearman):.3f}")
+    return {"timings": timings, "top_n_overlap": overlaps, "spearman": spearman}
+
+
+def _reciprocal_rank_fusion_serialized(results, k=60):
+    """ The previous util.reciprocal_rank_fusion: dumps() every doc as the dict key, loads() it back """
+    from langchain.load import dumps, loads
+    fused_scores = {}
+    for docs in results:
+        for rank, doc in enumerate(docs):
+            doc_str = dumps(doc)
+            if doc_str not in fused_scores:
+                fused_scores[doc_str] = 0
+            fused_scores[doc_str] += 1 / (rank + k)
+    return [
+        (loads(doc), score)
+        for doc, score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
+    ]
+
+
+def bench_rrf(num_lists=4, list_len=20, chunk_chars=2000, repeats=200):
+    """
+    util.reciprocal_rank_fusion vs. the serialize/deserialize version it
+    replaced, on RAG-Fusion-sized inputs with 2000-character chunks.
+    """
+    import random
+    from util import reciprocal_rank_fusion
+
+    rng = random.Random(0)
+    pool = [
+        Document(page_content=f"{i} " + "x" * chunk_chars, metadata={"id": f"src:{i}", "source": "src"})
+        for i in range(list_len * 2)
+    ]
+    results = [rng.sample(pool, list_len) for _ in range(num_lists)]
+
+    timings = {}
+    for name, fn in (("serialized", _reciprocal_rank_fusion_serialized), ("by_chunk_id", reciprocal_rank_fusion)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fused = fn(results)
+        timings[name] = (time.perf_counter() - start) / repeats
+        print(f"{name:>12} | {1000 * timings[name]:8.3f} ms per fusion ({len(fused)} docs)")
+    print(f"speed-up: {timings['serialized'] / timings['by_chunk_id']:.1f}x")
+    return timings
+
+
+def bench_cold_start(num_files=200, chars_per_file=20_000, dim=8):
+    """
+    Startup cost of Database + load_cached_docs over a populated cache:
+    first ingest, a restart that trusts the manifest, and a restart without
+    a manifest (the old full scan of the collection + every cache file).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = f"{tmp}/cache"
+        db_dir = f"{tmp}/db"
+        Path(cache_dir).mkdir()
+        for i in range(num_files):
+            payload = {"content": f"document {i} " + "lorem ipsum " * (chars_per_file // 12),
+                       "metadata": {"source": f"doc_{i}", "domain": "all"}}
+            (Path(cache_dir) / f"doc_{i}.json").write_text(json.dumps(payload), encoding="utf-8")
+
+        embed = DeterministicFakeEmbedding(size=dim)
+        timings = {}
+        for name in ("first_ingest", "manifest_restart", "no_manifest_restart"):
+            if name == "no_manifest_restart":
+                (Path(db_dir) / "manifest.json").unlink()
+            start = time.perf_counter()
+            db = Database(embed, db_dir, cache_dir)
+            db.load_cached_docs()
+            timings[name] = time.perf_counter() - start
+        print(f"{num_files} cached files")
+        for name, seconds in timings.items():
+            print(f"{name:>20} | {1000 * seconds:10.1f} ms")
+        return timings
+
+
+BENCHMARKS = {
+    "ingest": bench_bulk_ingest,
+    "async": bench_async_concurrency,
+    "onnx": bench_onnx_reranker,
+    "rrf": bench_rrf,
+    "cold_start": bench_cold_start,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"=== {name} ===")
+        BENCHMARKS[name]()
@@ -2,13 +2,45 @@ from tempfile import template
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough, RunnableParallel, RunnableLambda
+from langchain.retrievers import ContextualCompressionRetriever
 from util import *
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait as futures_wait
+import time
+import asyncio
 import prompt_template
 
+# Rewrites (LLM) that are not back within this many seconds are ignored
+REWRITE_BUDGET_SECONDS = 8.0
 
+# Separate pools, so rewrite LLM calls that overran their budget never hold up
+# searches or score-ahead work of later requests; the original question's search
+# runs on the caller's thread and never queues at all.
+_rewrite_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rewrite")
+_speculative_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="speculative")
+_score_ahead_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="score-ahead")
+# Fire-and-forget score-ahead futures, held until done so failures get logged
+_score_ahead_pending = set()
 
-def simple_rag_chain(llm, retriever):
+
+def _track_score_ahead(future):
+    _score_ahead_pending.add(future)
+    future.add_done_callback(_score_ahead_done)
+
+
+def _score_ahead_done(future):
+    _score_ahead_pending.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        print(f"⚠️  Scoring ahead failed: {future.exception()}")
+
+
+
+def context_formatter(packer=None):
+    """ docs -> prompt context; token-budgeted when a ContextPacker is given """
+    return RunnableLambda(packer.pack if packer is not None else format_docs)
+
+
+def simple_rag_chain(llm, retriever, packer=None):
     prompt = ChatPromptTemplate.from_template(prompt_template.QA_TEMPLATE)
     
     cached = (
@@ -17,7 +49,7 @@ def simple_rag_chain(llm, retriever):
     )
 
     chain = (
-        {"context": itemgetter("docs") | RunnableLambda(format_docs), "question": itemgetter("question")}
+        {"context": itemgetter("docs") | context_formatter(packer), "question": itemgetter("question")}
         | prompt
         | llm
         | StrOutputParser()
@@ -32,7 +64,117 @@ def simple_rag_chain(llm, retriever):
     )
 
 
-def multi_query_chain(llm, retriever):
+def split_rerank_retriever(retriever):
+    """ (base retriever, reranker or None) so fan-out chains can search cheaply and rerank once """
+    if isinstance(retriever, ContextualCompressionRetriever):
+        return retriever.base_retriever, retriever.base_compressor
+    return retriever, None
+
+
+def rerank_step(compressor):
+    """
+    {"question", "docs"} -> docs reranked against the question (no-op without a reranker).
+    The docs come from several queries, so their similarity scores are not comparable
+    and the cascade is turned off: every candidate is scored against the question.
+    """
+    kwargs = {"cascade": False} if getattr(compressor, "cascade", False) else {}
+
+    def _rerank(x):
+        if compressor is None or not x["docs"]:
+            return x["docs"]
+        return list(compressor.compress_documents(x["docs"], x["question"], **kwargs))
+
+    async def _arerank(x):
+        if compressor is None or not x["docs"]:
+            return x["docs"]
+        return list(await compressor.acompress_documents(x["docs"], x["question"], **kwargs))
+
+    return RunnableLambda(_rerank, afunc=_arerank)
+
+
+def speculative_retrieval(generate_queries_chain, retriever, reranker=None, rewrite_budget=REWRITE_BUDGET_SECONDS):
+    """
+    question -> union of retrieved docs for the question and its rewrites.
+
+    Retrieval for the original question starts right away, in parallel with
+    the LLM generating rewrites (and, when possible, its cross-encoder scores
+    are computed ahead of time so the final rerank hits the score cache).
+    Rewrite results are merged as they arrive; whatever is not back within
+    rewrite_budget seconds of the start is cancelled or, if already running,
+    no longer waited for.
+    """
+    # rerank_step scores every candidate (no cascade across queries), so scoring ahead is never wasted
+    score_ahead = getattr(reranker, "score_documents", None)
+
+    def _remaining(deadline):
+        return max(0.0, deadline - time.monotonic())
+
+    def _retrieve(question):
+        deadline = time.monotonic() + rewrite_budget
+        rewrites = _rewrite_executor.submit(generate_queries_chain.invoke, question)
+
+        results = [retriever.invoke(question)]
+        if score_ahead is not None and results[0]:
+            _track_score_ahead(_score_ahead_executor.submit(score_ahead, results[0], question))
+
+        try:
+            queries = rewrites.result(timeout=_remaining(deadline))
+        except FuturesTimeout:
+            rewrites.cancel()
+            print(f"⏱️  Query rewrites exceeded {rewrite_budget:.1f}s, using the original question only")
+            return get_unique_union_by_id(results)
+        except Exception as e:
+            print(f"⚠️  Query rewrite failed ({e}), using the original question only")
+            return get_unique_union_by_id(results)
+
+        pending = [_speculative_executor.submit(retriever.invoke, q) for q in queries if q != question]
+        done, not_done = futures_wait(pending, timeout=_remaining(deadline))
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            print(f"⏱️  Dropping {len(not_done)} slow rewrite retrievals")
+        results.extend(f.result() for f in pending if f in done and f.exception() is None)
+        return get_unique_union_by_id(results)
+
+    async def _aretrieve(question):
+        deadline = time.monotonic() + rewrite_budget
+        rewrites = asyncio.ensure_future(generate_queries_chain.ainvoke(question))
+
+        try:
+            results = [await retriever.ainvoke(question)]
+        except BaseException:
+            rewrites.cancel()
+            raise
+        if score_ahead is not None and results[0]:
+            _track_score_ahead(asyncio.get_running_loop().run_in_executor(_score_ahead_executor, score_ahead, results[0], question))
+
+        try:
+            queries = await asyncio.wait_for(rewrites, timeout=_remaining(deadline))  # cancels on timeout
+        except asyncio.TimeoutError:
+            print(f"⏱️  Query rewrites exceeded {rewrite_budget:.1f}s, using the original question only")
+            return get_unique_union_by_id(results)
+        except Exception as e:
+            print(f"⚠️  Query rewrite failed ({e}), using the original question only")
+            return get_unique_union_by_id(results)
+
+        pending = [asyncio.ensure_future(retriever.ainvoke(q)) for q in queries if q != question]
+        if pending:
+            done, not_done = await asyncio.wait(pending, timeout=_remaining(deadline))
+            if not_done:
+                for task in not_done:
+                    task.cancel()
+                print(f"⏱️  Dropping {len(not_done)} slow rewrite retrievals")
+            results.extend(t.result() for t in pending if t in done and t.exception() is None)
+        return get_unique_union_by_id(results)
+
+    return RunnableLambda(_retrieve, afunc=_aretrieve)
+
+
+def multi_query_chain(llm, retriever, packer=None, rewrite_budget=REWRITE_BUDGET_SECONDS):
+    # Vector-search every query variant concurrently, then send the deduped
+    # union through the cross-encoder once, against the original question.
+    base_retriever, reranker = split_rerank_retriever(retriever)
+
     prompt_perspectives = ChatPromptTemplate.from_template(prompt_template.MULTI_QUERY_TEMPLATE)
 
 
@@ -43,29 +185,18 @@ def multi_query_chain(llm, retriever):
         | split_queries
     )
 
-    generate_queries_chain_with_original = (
-        RunnableParallel(
-            question=RunnablePassthrough(),   # pass the original question forward
-            queries=generate_queries_chain    # run the alt query generator
-        )
-        | RunnableLambda(lambda x: [x["question"], *x["queries"]])  # merge them into one list
-)
-
-    retrieval_chain = (
-        generate_queries_chain_with_original
-        | retriever.map()
-        | get_unique_union
-    )
+    retrieval_chain = speculative_retrieval(generate_queries_chain, base_retriever, reranker, rewrite_budget)
 
     cached = (
         {"question": RunnablePassthrough()}
         | RunnablePassthrough.assign(docs = itemgetter("question") | retrieval_chain)
+        | RunnablePassthrough.assign(docs = rerank_step(reranker))
     )
 
     prompt = ChatPromptTemplate.from_template(prompt_template.QA_TEMPLATE)
 
     final_chain = (
-        {"context": itemgetter("docs") | RunnableLambda(format_docs), "question": itemgetter("question")}
+        {"context": itemgetter("docs") | context_formatter(packer), "question": itemgetter("question")}
         | prompt
         | llm
         | StrOutputParser()
@@ -79,7 +210,12 @@ def multi_query_chain(llm, retriever):
         })
     )
 
-# def rag_fusion_chain(llm, retriever):
+def rag_fusion_chain(llm, retriever, packer=None):
+    # Rewrites + original question are searched concurrently and fused with RRF;
+    # the fused order replaces the cross-encoder, only its top_n is kept
+    # (limit_docs' default when reranking is off).
+    base_retriever, reranker = split_rerank_retriever(retriever)
+    top_n = getattr(reranker, "top_n", None)
 
     prompt_perspectives = ChatPromptTemplate.from_template(prompt_template.MULTI_QUERY_TEMPLATE)
 
@@ -90,22 +226,37 @@ def multi_query_chain(llm, retriever):
         | split_queries
     )
 
+    def _fuse(ranked_lists):
+        # Confidence = RRF score relative to the best possible one (first in every list)
+        best = len(ranked_lists) / RRF_K
+        fused = []
+        for doc, score in reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+            point = min(1.0, score / best) if best else 0.0
+            doc.metadata["rrf_score"] = score
+            doc.metadata["confidence"] = point
+            doc.metadata["confidence_label"] = confidence_label(point)
+            fused.append(doc)
+        return fused[:top_n] if top_n else limit_docs(fused)
+
     retrieval_chain = (
-        generate_queries_chain
-        | retriever.map()
-        | get_unique_union
+        RunnableParallel(
+            question=RunnablePassthrough(),
+            queries=generate_queries_chain
+        )
+        | RunnableLambda(lambda x: [x["question"], *x["queries"]])
+        | base_retriever.map()     # batch -> concurrent searches
+        | RunnableLambda(_fuse)
     )
 
     cached = (
         {"question": RunnablePassthrough()}
         | RunnablePassthrough.assign(docs = itemgetter("question") | retrieval_chain)
-        | RunnablePassthrough.assign(ranked_docs = itemgetter("docs") | RunnableLambda(reciprocal_rank_fusion))
     )
 
     prompt = ChatPromptTemplate.from_template(prompt_template.QA_TEMPLATE)
 
     final_chain = (
-        {"context": itemgetter("ranked_docs"), "question": RunnablePassthrough()}
+        {"context": itemgetter("docs") | context_formatter(packer), "question": itemgetter("question")}
         | prompt
         | llm
         | StrOutputParser()
@@ -118,6 +269,3 @@ def multi_query_chain(llm, retriever):
             "docs": itemgetter("docs")
         })
     )
-    
-
-    
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+
+_SIMPLE_TYPES = (str, int, float, bool, type(None), list, tuple)
+
+
+def splitter_key(splitter) -> str:
+    # Class + plain-valued settings (chunk size, overlap, separators...); callables are ignored
+    settings = {
+        name: value for name, value in sorted(vars(splitter).items())
+        if isinstance(value, _SIMPLE_TYPES)
+    }
+    raw = json.dumps([type(splitter).__name__, settings], sort_keys=True, default=repr)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class ChunkStore:
+    """
+    Split results persisted per (document content hash, splitter config).
+
+    Each entry is two files: <key>.txt with every chunk's UTF-8 text back to
+    back, and <key>.npy with one row per chunk of
+    (byte offset, byte length, start_index, page_start, page_end), -1 when
+    unset. Both are memory-mapped on read, so an unchanged document under an
+    unchanged splitter is never split again.
+    """
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def document_hash(doc: Document) -> str:
+        digest = hashlib.sha256(doc.page_content.encode("utf-8"))
+        page_offsets = doc.metadata.get("page_offsets")
+        if page_offsets:
+            digest.update(json.dumps(page_offsets).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _paths(self, doc_hash: str, config: str) -> tuple[Path, Path]:
+        base = self.root / config / doc_hash[:2] / doc_hash
+        return base.with_suffix(".txt"), base.with_suffix(".npy")
+
+    def get(self, doc: Document, config: str) -> Optional[List[Document]]:
+        text_path, index_path = self._paths(self.document_hash(doc), config)
+        if not index_path.exists():
+            with self._lock:
+                self.misses += 1
+            return None
+
+        index = np.load(index_path, mmap_mode="r")
+        base_meta = {k: v for k, v in doc.metadata.items() if k != "page_offsets"}
+        chunks = []
+        with open(text_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            try:
+                for offset, length, start, page_start, page_end in index:
+                    meta = dict(base_meta)
+                    if start >= 0:
+                        meta["start_index"] = int(start)
+                    if page_start >= 0:
+                        meta["page_start"] = int(page_start)
+                        meta["page_end"] = int(page_end)
+                    text = bytes(data[int(offset):int(offset) + int(length)]).decode("utf-8")
+                    chunks.append(Document(page_content=text, metadata=meta))
+            finally:
+                if size:
+                    data.close()
+        with self._lock:
+            self.hits += 1
+        return chunks
+
+    def put(self, doc: Document, config: str, chunks: List[Document]):
+        text_path, index_path = self._paths(self.document_hash(doc), config)
+        text_path.parent.mkdir(parents=True, exist_ok=True)
+
+        rows, parts, offset = [], [], 0
+        for chunk in chunks:
+            encoded = chunk.page_content.encode("utf-8")
+            meta = chunk.metadata
+            rows.append((
+                offset,
+                len(encoded),
+                meta.get("start_index", -1),
+                meta.get("page_start", -1),
+                meta.get("page_end", -1),
+            ))
+            parts.append(encoded)
+            offset += len(encoded)
+
+        # text first, index last: an entry only counts once its index exists
+        tmp_text = text_path.with_name(text_path.name + ".tmp")
+        tmp_text.write_bytes(b"".join(parts))
+        os.replace(tmp_text, text_path)
+        tmp_index = index_path.with_name(index_path.stem + ".tmp.npy")
+        np.save(tmp_index, np.asarray(rows, dtype=np.int64).reshape(-1, 5))
+        os.replace(tmp_index, index_path)
+
+    def stats(self) -> Dict[str, int | float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
@@ -128,6 +128,14 @@ def adjust_threshold(rag: Rag):
         except ValueError:
             print("Invalid number.")
 
+def print_retrieved_docs(docs):
+    print(f"\nRetrieved {len(docs)} documents:")
+    for idx, doc in enumerate(docs, start=1):
+        meta = doc.metadata or {}
+        conf = meta.get("confidence")
+        conf_str = f"{float(conf):.2f}" if conf is not None else "N/A"
+        print(f"  {idx}. {meta.get('source', 'Unknown source')} • Confidence: {conf_str} ({meta.get('confidence_label', 'unknown')})")
+
 def run_query_session(rag: Rag):
     print(f"\nEntering query mode with {format_rag_type(rag.get_rag_type())}. Type 'back' to return.")
     while True:
@@ -139,14 +147,20 @@ def run_query_session(rag: Rag):
             return
         try:
             print("Processing...")
-            response = rag.invoke(q)
-            answer = response.get("answer", "No answer.")
-            docs = response.get("docs", [])
+            answer_started = False
+            for chunk in rag.stream(q):
+                if "docs" in chunk:
+                    print_retrieved_docs(chunk["docs"] or [])
+                if chunk.get("answer"):
+                    if not answer_started:
+                        print("\n" + "-" * 50)
+                        print("RESULT")
+                        print("-" * 50)
+                        answer_started = True
+                    print(chunk["answer"], end="", flush=True)
+            if not answer_started:
+                print("No answer.")
             print("\n" + "-" * 50)
-            print("RESULT")
-            print("-" * 50)
-            print(answer)
-            print("-" * 50)
         except KeyboardInterrupt:
             print("\nCancelled.")
         except Exception as e:
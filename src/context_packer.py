@@ -0,0 +1,145 @@
+import threading
+from functools import lru_cache
+from typing import Callable, Dict, List
+from langchain_core.documents import Document
+from util import source_key
+
+# Ollama model -> Hugging Face tokenizer with the same vocabulary
+TOKENIZER_REPOS = {
+    "llama3:8b": "meta-llama/Meta-Llama-3-8B-Instruct",
+    "llama3.2:latest": "meta-llama/Llama-3.2-3B-Instruct",
+    "llama3-chatqa:latest": "nvidia/Llama3-ChatQA-1.5-8B",
+    "gemma3:1b": "google/gemma-3-1b-it",
+    "qwen3:8b": "Qwen/Qwen3-8B",
+}
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model_name: str) -> Callable[[str], int]:
+    """
+    Token counter for an Ollama model: its Hugging Face tokenizer when it is
+    already in the local cache (never fetched from the Hub, several are gated),
+    else tiktoken's cl100k_base (close to Llama 3's BPE), else ~4 chars/token.
+    """
+    repo = TOKENIZER_REPOS.get(model_name)
+    if repo:
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(repo, local_files_only=True)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            pass
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return lambda text: max(1, len(text) // 4)
+
+
+class ContextPacker:
+    """
+    Replacement for format_docs that fills a token budget instead of
+    concatenating every chunk: chunks are taken best-first (rerank, then
+    similarity / RRF score), the overlap the splitter leaves between
+    neighbouring chunks of one source is trimmed, and the last chunk that
+    does not fit is truncated.
+    """
+    def __init__(self, model_name: str, token_budget: int = 3000, min_chunk_tokens: int = 50):
+        self.model_name = model_name
+        self.token_budget = token_budget
+        self.min_chunk_tokens = min_chunk_tokens
+        self.count_tokens = get_token_counter(model_name)
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    @staticmethod
+    def _rank(docs: List[Document]) -> List[Document]:
+        # Sort by the most authoritative score, but only when every doc carries it.
+        # Scores are never mixed: a cascade leaves cross-encoder logits on some docs
+        # and 0..1 similarities on others, and then the order the reranker returned
+        # is already the intended one.
+        for field in ("rerank_score", "rrf_score", "similarity_score"):
+            present = sum(d.metadata.get(field) is not None for d in docs)
+            if present == 0:
+                continue
+            if present < len(docs):
+                return list(docs)
+            return sorted(docs, key=lambda d: float(d.metadata[field]), reverse=True)  # stable: ties keep retrieval order
+        return list(docs)
+
+    @staticmethod
+    def _trim_overlap(doc: Document, spans: Dict[str, List[tuple[int, int]]]) -> str:
+        # spans: util.source_key -> [(start, end)] of chunks already packed
+        text = doc.page_content
+        start = doc.metadata.get("start_index", -1)
+        source = source_key(doc.metadata)
+        if start is None or start < 0 or source not in spans:
+            return text
+
+        end = start + len(text)
+        head, tail = start, end
+        for s, e in spans[source]:
+            if s <= head < e:
+                head = e       # an earlier-packed chunk already covers our beginning
+            if s < tail <= e:
+                tail = s       # ... or our end
+        if head >= tail:
+            return ""
+        return text[head - start: tail - start]
+
+    def _truncate(self, text: str, tokens: int, limit: int) -> str:
+        # proportional cut, then shave until it fits
+        cut = text[: max(0, int(len(text) * limit / tokens))]
+        while cut and self.count_tokens(cut) > limit:
+            cut = cut[: int(len(cut) * 0.9)]
+        return cut
+
+    def pack(self, docs: List[Document]) -> str:
+        ranked = self._rank(docs)
+        spans: Dict[str, List[tuple[int, int]]] = {}
+        parts: List[str] = []
+        used = 0
+
+        for doc in ranked:
+            remaining = self.token_budget - used
+            if remaining < self.min_chunk_tokens:
+                break
+            text = self._trim_overlap(doc, spans).strip()
+            if not text:
+                continue
+            tokens = self.count_tokens(text)
+            if tokens > remaining:
+                text = self._truncate(text, tokens, remaining)
+                tokens = self.count_tokens(text)
+                if not text:
+                    break
+            parts.append(text)
+            used += tokens
+
+            start = doc.metadata.get("start_index", -1)
+            if start is not None and start >= 0:
+                spans.setdefault(source_key(doc.metadata), []).append((start, start + len(doc.page_content)))
+
+        context = "\n\n".join(parts)
+        original = self.count_tokens("\n\n".join(d.page_content for d in docs))
+        packed = self.count_tokens(context)
+        with self._lock:
+            self.queries += 1
+            self.tokens_in += original
+            self.tokens_out += packed
+        print(f"🧮 Context: {original} → {packed} tokens (saved {original - packed}, {len(parts)}/{len(docs)} chunks)")
+        return context
+
+    def stats(self) -> Dict[str, int | float]:
+        with self._lock:
+            saved = self.tokens_in - self.tokens_out
+            return {
+                "queries": self.queries,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": saved,
+                "avg_saved_per_query": saved / self.queries if self.queries else 0.0,
+            }
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import ormsgpack
+import zstandard
+from langchain_core.documents import Document
+
+
+def source_sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """
+    Docling conversions keyed by the sha256 of the source file's bytes.
+
+    Each conversion is one zstd-compressed msgpack record
+    ({"content", "metadata"}) under <cache_dir>/objects/<hh>/<hash>.msgpack.zst.
+    A small SQLite index remembers, per source path, the (mtime, size) it had
+    when it was hashed and the source/domain it is indexed under, so an
+    untouched file is neither re-read nor reconverted, and a copied or renamed
+    one is found by hash. Identical bytes at two paths share one record but
+    stay two entries.
+    """
+    suffix = ".msgpack.zst"
+
+    def __init__(self, cache_dir: str | Path, level: int = 10):
+        self.root = Path(cache_dir)
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                hash TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                domain TEXT,
+                stored_bytes INTEGER NOT NULL,
+                converted_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS paths (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                source TEXT,
+                domain TEXT
+            )
+            """
+        )
+        # indexes created before paths carried their own source/domain
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(paths)")}
+        for column in ("source", "domain"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE paths ADD COLUMN {column} TEXT")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def record_path(self, content_hash: str) -> Path:
+        return self.objects_dir / content_hash[:2] / f"{content_hash}{self.suffix}"
+
+    def hash_of(self, path: str | Path) -> str:
+        # Re-hash only when the file's (mtime, size) changed since we last saw it
+        key = str(Path(path).resolve())
+        st = os.stat(key)
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns, size, hash FROM paths WHERE path = ?", (key,)).fetchone()
+        if row and (row[0], row[1]) == (st.st_mtime_ns, st.st_size):
+            return row[2]
+
+        content_hash = source_sha256(key)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO paths (path, mtime_ns, size, hash) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, hash = excluded.hash",
+                (key, st.st_mtime_ns, st.st_size, content_hash),
+            )
+            self._conn.commit()
+        return content_hash
+
+    def label(self, path: str | Path, source: str, domain: str | None):
+        # Source/domain this path's conversion is indexed under (set on every put or cache hit)
+        self.hash_of(path)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE paths SET source = ?, domain = ? WHERE path = ?",
+                (source, domain, str(Path(path).resolve())),
+            )
+            self._conn.commit()
+
+    def get(self, path: str | Path) -> Optional[Document]:
+        # Cached conversion of path's current bytes, or None
+        try:
+            content_hash = self.hash_of(path)
+        except OSError:
+            return None
+        record = self.record_path(content_hash)
+        if not record.exists():
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return self.read(record)
+
+    def put(self, path: str | Path, content: str, metadata: Dict) -> Path:
+        content_hash = self.hash_of(path)
+        self.label(path, metadata.get("source", "unknown"), metadata.get("domain"))
+        record = self.record_path(content_hash)
+        if record.exists():
+            return record
+
+        blob = self._compressor.compress(ormsgpack.packb({"content": content, "metadata": metadata}))
+        record.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = record.with_name(record.name + ".tmp")
+        tmp_path.write_bytes(blob)
+        os.replace(tmp_path, record)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO records (hash, source, domain, stored_bytes, converted_at) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, metadata.get("source", "unknown"), metadata.get("domain"), len(blob), time.time()),
+            )
+            self._conn.commit()
+        self._drop_superseded()
+        return record
+
+    def _drop_superseded(self):
+        # Records no path points at any more (the file was edited and reconverted)
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT hash FROM records WHERE hash NOT IN (SELECT hash FROM paths)"
+            )]
+            if stale:
+                self._conn.executemany("DELETE FROM records WHERE hash = ?", [(h,) for h in stale])
+                self._conn.commit()
+        for content_hash in stale:
+            self.record_path(content_hash).unlink(missing_ok=True)
+
+    @staticmethod
+    def read(record: str | Path) -> Document:
+        raw = ormsgpack.unpackb(zstandard.ZstdDecompressor().decompress(Path(record).read_bytes()))
+        return Document(page_content=raw["content"], metadata=raw.get("metadata") or {})
+
+    def entries(self) -> List[Tuple[Path, str, Optional[str]]]:
+        # (record file, source, domain) for the current conversion of every known path.
+        # A record only counts while some path's latest hash points at it, and it
+        # is listed once per distinct (source, domain) that points at it.
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT p.hash, COALESCE(p.source, r.source), COALESCE(p.domain, r.domain) "
+                "FROM paths p JOIN records r ON r.hash = p.hash ORDER BY 2, 3"
+            ).fetchall()
+        return [(self.record_path(h), source, domain) for h, source, domain in rows if self.record_path(h).exists()]
+
+    def sources(self) -> List[str]:
+        return [source for _, source, _ in self.entries()]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM paths")
+            self._conn.commit()
+        for record in self.objects_dir.glob(f"*/*{self.suffix}"):
+            record.unlink()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            records, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(stored_bytes), 0) FROM records"
+            ).fetchone()
+            return {"records": records, "stored_bytes": stored, "hits": self.hits, "misses": self.misses}
@@ -4,82 +4,312 @@ from enum_manager import *
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 import json  # add
+import hashlib
+import asyncio
+from bisect import bisect_right
 from pathlib import Path
 import shutil
+from typing import NamedTuple
 from langchain_experimental.text_splitter import SemanticChunker
 from util import *
+from embedding_cache import EmbeddingStore, CachedEmbeddings, QueryEmbeddingCache
+from embedding_client import BatchedEmbeddings
+from manifest import IngestionManifest, file_sha256
+from source_registry import SourceRegistry
+from conversion_cache import ConversionCache
+from chunk_store import ChunkStore, splitter_key
     
+# Chunk metadata that locates a chunk in its document; may change while the chunk's ID does not
+POSITION_KEYS = ("start_index", "page_start", "page_end")
+
+
+class CacheEntry(NamedTuple):
+    """ A cached conversion as one indexed document; one record file can back several """
+    file: Path
+    source: str
+    domain: str | None
+
+    @property
+    def is_legacy(self) -> bool:
+        # pre-record <stem>.json files carry their own metadata
+        return not self.file.name.endswith(ConversionCache.suffix)
+
+    @property
+    def key(self) -> str:
+        return source_key({"source": self.source, "domain": self.domain})
+
+    @property
+    def name(self) -> str:
+        # manifest key
+        return self.file.name if self.is_legacy else f"{self.key}@{self.file.name}"
+
+
 class Database:
-    def __init__(self, embed, dir, cache_dir):
+    def __init__(self, embed, dir, cache_dir, embed_batch_size=64, embed_in_flight=4,
+                 query_cache_size=1024, persist_query_embeddings=False):
+        # Cache misses go to the embedding server in tunable, concurrent batches
+        self.embed_client = BatchedEmbeddings(embed, batch_size=embed_batch_size, max_in_flight=embed_in_flight)
+        # Chunk embeddings are cached on disk by (model, content hash), so rebuilding
+        # the index with unchanged chunks needs no calls to the embedding model.
+        self.embedding_store = EmbeddingStore(Path(dir) / "embedding_cache.sqlite")
+        self.embed = CachedEmbeddings(self.embed_client, self.embedding_store)
+        # Query vectors are shared by every retriever, multi-query branch and evaluator run
+        self.query_cache = QueryEmbeddingCache(
+            max_entries=query_cache_size,
+            store=self.embedding_store if persist_query_embeddings else None,
+        )
         self.db = Chroma(
             persist_directory = dir,
-            embedding_function = embed
+            embedding_function = self.embed
         )
 
         # self.splitter = SemanticChunker(embed)
-        self.splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200, add_start_index=True)
         # self.splitter = KamradtModifiedChunker(avg_chunk_size=400, min_chunk_size=50, embedding_function= self.embed)
-        self.source_id_map = {}  # source file path -> list of chunk IDs
+        # Split results per (document hash, splitter config), reused across runs and experiments
+        self.chunk_store = ChunkStore(Path(dir) / "chunk_store")
         self.cache_dir = cache_dir
+        self.conversion_cache = ConversionCache(cache_dir)
+        self._id_index: set[str] | None = None  # every chunk ID in the collection
+        self._id_index_stamp = None  # manifest stamp the ID set was loaded at
+        # What has already been ingested from the cache, so startup only needs to stat files
+        self.manifest = IngestionManifest(Path(dir) / "manifest.json")
+        self.generation = self.manifest.generation  # bumped whenever the indexed content changes
+        # source -> domain / chunk IDs / content hash, so "what is loaded" never scans the collection
+        self.registry = SourceRegistry(Path(dir) / "source_registry.sqlite")
+        self._backfill_registry()
 
     def add(self, big_chunks):
-        for chunks in self.batch(big_chunks, 2000):
-            self.add_to_db(chunks)
+        """
+        Sync the given chunks into the DB. Chunks are treated as the complete,
+        current content of each source they belong to: unchanged chunks are
+        skipped, new/edited ones are added and chunks that vanished from a
+        source are deleted.
+        """
+        chunks = self.calculate_chunk_ids(big_chunks)
+        self.delete(self.get_stale_ids(chunks))
+        for batch in self.batch(chunks, 2000):
+            self.add_to_db(batch)
+        self.register_sources(chunks)
+
+        stats = self.embed_client.stats()
+        if stats["chunks"]:
+            print(f"📈 Embedding throughput: {stats['chunks_per_second']:.1f} chunks/s "
+                  f"({stats['chunks']} chunks, {stats['requests']} requests, {stats['retries']} retries)")
 
     def add_to_db(self, chunks):
-        chunks_with_id = self.calculate_chunk_ids(chunks)
-        existing_items = self.db.get(include=[])
-        existing_ids = set(existing_items['ids'])
+        missing_ids = [chunk for chunk in chunks if "id" not in chunk.metadata]
+        if missing_ids:
+            self.calculate_chunk_ids(missing_ids)
+        existing_ids = self.get_id_index()
         print(f"Number of existing documents in DB: {len(existing_ids)}")
 
         # Add new chunks
         new_chunks = []
-        for chunk in chunks_with_id:
+        kept_chunks = []
+        for chunk in chunks:
             if chunk.metadata["id"] not in existing_ids:
                 new_chunks.append(chunk)
+            else:
+                kept_chunks.append(chunk)
         
         if len(new_chunks):
             print(f"👉 Adding new documents: {len(new_chunks)}")
             new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
             self.db.add_documents(new_chunks, ids=new_chunk_ids)
+            existing_ids.update(new_chunk_ids)
+            self.generation += 1
 
         else:
             print("✅ No new documents to add")
 
+        self.update_positions(kept_chunks)
+
+    def update_positions(self, chunks):
+        # Chunks whose content (and so ID) is unchanged can still have moved in an edited
+        # document; refresh their position metadata in place, without re-embedding
+        if not chunks:
+            return
+        stored = self.db.get(ids=[chunk.metadata["id"] for chunk in chunks], include=["metadatas"])
+        stored_meta = dict(zip(stored["ids"], stored["metadatas"]))
+
+        ids, metadatas = [], []
+        for chunk in chunks:
+            old = stored_meta.get(chunk.metadata["id"])
+            if old is None:
+                continue
+            new_position = {k: chunk.metadata[k] for k in POSITION_KEYS if k in chunk.metadata}
+            if new_position == {k: old[k] for k in POSITION_KEYS if k in old}:
+                continue
+            meta = {k: v for k, v in old.items() if k not in POSITION_KEYS}
+            meta.update(new_position)
+            ids.append(chunk.metadata["id"])
+            metadatas.append(meta)
+
+        if ids:
+            print(f"📍 Updating positions of {len(ids)} moved chunks")
+            self.db._collection.update(ids=ids, metadatas=metadatas)
+            self.generation += 1
+
+    def get_stale_ids(self, chunks) -> list[str]:
+        # IDs stored for a source that are no longer produced by its current chunks
+        current: dict[str, set[str]] = {}
+        for chunk in chunks:
+            current.setdefault(source_key(chunk.metadata), set()).add(chunk.metadata["id"])
+
+        stale = []
+        for key, ids in current.items():
+            stale.extend(self.get_source_ids(key) - ids)
+        if stale:
+            print(f"🧹 Removing {len(stale)} stale chunks from {len(current)} sources")
+        return stale
+
+    def get_source_ids(self, key) -> set[str]:
+        # key: util.source_key, i.e. "<domain>/<source>"
+        if key is None:
+            return set()
+        ids = self.registry.get_chunk_ids(key)
+        if ids is not None:
+            return ids
+        domain, _, source = key.rpartition("/")
+        where = {"$and": [{"source": source}, {"domain": domain}]} if domain else {"source": source}
+        return set(self.db.get(where=where, include=[])["ids"])
+
+    def register_sources(self, chunks):
+        # Record the complete chunk set of every source in chunks
+        self.registry.put_many(SourceRegistry.group_by_source(
+            (chunk.metadata["id"] for chunk in chunks), (chunk.metadata for chunk in chunks)
+        ))
+
+    def _backfill_registry(self):
+        # One full metadata scan for collections built before the registry existed
+        if not self.registry.is_empty() or self.db._collection.count() == 0:
+            return
+        existing = self.db.get(include=["metadatas"])
+        count = self.registry.backfill(existing["ids"], existing["metadatas"])
+        print(f"🗂️  Source registry backfilled with {count} sources")
+
+    def delete_source(self, source: str, domain: str | None = None) -> int:
+        # Without a domain, the source is removed from every domain it was loaded in
+        keys = [source_key({"source": source, "domain": domain})] if domain else self.registry.keys_for(source)
+        deleted = 0
+        for key in keys:
+            ids = self.get_source_ids(key)
+            self.delete(list(ids))
+            self.registry.remove(key)
+            deleted += len(ids)
+        self.save_manifest()  # lets other processes see the index changed
+        print(f"🗑️  Deleted {deleted} chunks of {source}")
+        return deleted
+
+    def get_id_index(self) -> set[str]:
+        # Pull the IDs from Chroma once and keep the set in sync on add/delete; reload
+        # when another process sharing the DB directory changed the index (manifest stamp moved)
+        stamp = self.manifest.stamp()
+        if self._id_index is None or stamp != self._id_index_stamp:
+            self._id_index = set(self.db.get(include=[])["ids"])
+            self._id_index_stamp = stamp
+        return self._id_index
+
+    def has_id(self, chunk_id: str) -> bool:
+        return chunk_id in self.get_id_index()
+
+    def delete(self, ids: list[str]):
+        if not ids:
+            return
+        self.db.delete(ids=list(ids))
+        self.get_id_index().difference_update(ids)
+        self.generation += 1
 
     def calculate_chunk_ids(self, chunks):
 
-        # This will create IDs like "data/monopoly.pdf:6:2"
-        # Page Source : Page Number : Chunk Index
+        # This will create IDs like "economics/monopoly:3f2a9c0d1b7e4a65"
+        # Domain/Source : Content hash (+ ":n" for repeated identical chunks in one source)
+        # Deterministic, so an edited document only changes the IDs of the edited chunks,
+        # and same-stem files in different domains never share an ID.
 
-        last_page_id = None
-    
+        seen = {}
 
         for chunk in chunks:
-            source = chunk.metadata.get("source")
-            current_chunk_index = self.get_current_source_index(source)
-            self.set_current_source_index(source, current_chunk_index + 1)
-            # Calculate the chunk ID.
-            chunk_id = f"{source}:{current_chunk_index}"
+            key = source_key(chunk.metadata)
+            digest = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()[:16]
+            chunk_id = f"{key}:{digest}"
+
+            occurrence = seen.get(chunk_id, 0)
+            seen[chunk_id] = occurrence + 1
+            if occurrence:
+                chunk_id = f"{chunk_id}:{occurrence}"
             
             # Add it to the page meta-data.
             chunk.metadata["id"] = chunk_id
 
         return chunks
 
-    def get_current_source_index(self,src) -> int:
-        return self.source_id_map.get(src, 0)
-    
-    def set_current_source_index(self,src, index):
-        self.source_id_map[src] = index
-    
     def get_loaded_src(self) -> list[str]:
-        existing = self.db.get(include=["metadatas"])
-        loaded_sources = {meta["source"] for meta in existing["metadatas"] if "source" in meta}
-        return list(loaded_sources)
+        return self.registry.sources()
+
+    def get_loaded_keys(self) -> list[str]:
+        return self.registry.keys()
+
+    def get_source_info(self, source: str, domain: str | None = None) -> dict | None:
+        return self.registry.get(source_key({"source": source, "domain": domain}))
+
+    def get_registry_stats(self) -> dict:
+        return self.registry.stats()
     
+    def embed_query(self, query: str) -> list[float]:
+        return self.query_cache.get_or_compute(self.embed.model, query, self.embed.embed_query)
+
+    def similarity_search(self, query: str, k: int = 20, threshold: float = 0.0, filter: dict | None = None) -> list[Document]:
+        """
+        Same results as as_retriever(search_type="similarity_score_threshold"),
+        but the query embedding comes from the shared LRU cache. The relevance
+        score is kept on each document as metadata["similarity_score"].
+        """
+        embedding = self.embed_query(query)
+        results = self.db.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)
+        return self._apply_threshold(results, threshold)
+
+    def _apply_threshold(self, results, threshold: float) -> list[Document]:
+        relevance = self.db._select_relevance_score_fn()
+
+        docs = []
+        for doc, distance in results:
+            score = relevance(distance)
+            if score >= threshold:
+                doc.metadata["similarity_score"] = float(score)
+                docs.append(doc)
+        return docs
+
+    async def aembed_query(self, query: str) -> list[float]:
+        return await self.query_cache.aget_or_compute(self.embed.model, query, self.embed.aembed_query)
+
+    async def asimilarity_search(self, query: str, k: int = 20, threshold: float = 0.0, filter: dict | None = None) -> list[Document]:
+        # Embedding goes through Ollama's async client; Chroma itself is sync, so search in a thread
+        embedding = await self.aembed_query(query)
+        results = await asyncio.to_thread(
+            self.db.similarity_search_by_vector_with_relevance_scores, embedding, k=k, filter=filter
+        )
+        return self._apply_threshold(results, threshold)
+
+    def clear_query_cache(self):
+        self.query_cache.clear()
+
+    def get_query_cache_stats(self) -> dict:
+        return self.query_cache.stats()
+
+    def get_embedding_cache_stats(self) -> dict:
+        return self.embed.stats()
+
+    def get_embedding_client_stats(self) -> dict:
+        return self.embed_client.stats()
+
     def clear(self):
         self.db.delete_collection()
+        self._id_index = None
+        self.generation += 1
+        self.manifest.clear()
+        self.registry.clear()
         print("🗑️  Database cleared")
 
 
@@ -88,7 +318,34 @@ class Database:
             yield docs[i:i+size]
 
     def split_documents(self, documents):
-        return self.splitter.split_documents(documents)
+        config = splitter_key(self.splitter)
+        chunks = []
+        for doc in documents:
+            stored = self.chunk_store.get(doc, config)
+            if stored is None:
+                stored = self.splitter.split_documents([doc])
+                for chunk in stored:
+                    self.set_page_metadata(chunk)
+                self.chunk_store.put(doc, config, stored)
+            chunks.extend(stored)
+        return chunks
+
+    def get_chunk_store_stats(self) -> dict:
+        return self.chunk_store.stats()
+
+    @staticmethod
+    def set_page_metadata(chunk):
+        # Sharded PDFs carry [[char_offset, page_no], ...]; Chroma only takes scalars,
+        # so turn it into the page span this chunk covers.
+        page_offsets = chunk.metadata.pop("page_offsets", None)
+        start = chunk.metadata.get("start_index", -1)
+        if not page_offsets or start < 0:
+            return
+        starts = [offset for offset, _ in page_offsets]
+        first = max(bisect_right(starts, start) - 1, 0)
+        last = max(bisect_right(starts, start + len(chunk.page_content) - 1) - 1, 0)
+        chunk.metadata["page_start"] = page_offsets[first][1]
+        chunk.metadata["page_end"] = page_offsets[last][1]
 
 
     def parse_json_to_document(self, json_path: str) -> Document:
@@ -121,47 +378,161 @@ class Database:
         print(raw)
         
         
+    def read_cached_document(self, cached_file: Path, source: str | None = None, domain: str | None = None) -> Document:
+        # Conversion records, or the JSON files written before the record format.
+        # A record shared by several paths is relabelled with the entry's source/domain.
+        if cached_file.name.endswith(ConversionCache.suffix):
+            doc = self.conversion_cache.read(cached_file)
+        else:
+            doc = self.parse_json_to_document(str(cached_file))
+        if source is not None:
+            doc.metadata["source"] = source
+            doc.metadata["domain"] = domain
+        return doc
+
+    def _read_entry(self, entry: CacheEntry) -> Document:
+        if entry.is_legacy:
+            return self.read_cached_document(entry.file)
+        return self.read_cached_document(entry.file, entry.source, entry.domain)
+
     def get_cached_docs(self) -> list[Document]:
-        loaded_tokens = build_match_tokens(self.get_loaded_src())
+        found, _ = self._scan_cached()
+        return [doc for _, doc in found]
 
-        docs = []
+    def _scan_cached(self) -> tuple[list[tuple[CacheEntry, Document]], list[CacheEntry]]:
+        # ([(entry, document)] not loaded yet, [entries whose source is already loaded]);
+        # entries that fail to parse are in neither
+        loaded_tokens = build_key_tokens(self.get_loaded_keys())
 
-        for cached_file in self._list_cache_files():
-            cache_tokens = build_match_tokens([
-                cached_file.name,
-                cached_file.stem,
-                cached_file.with_suffix("").name,
-            ])
-            if not cache_tokens.isdisjoint(loaded_tokens):
-                continue
+        found = []
+        already_loaded = []
+
+        for entry in self._cache_entries():
             try:
-                docs.append(self.parse_json_to_document(str(cached_file)))
+                # legacy JSON files only know their domain from their content
+                doc = self._read_entry(entry) if entry.is_legacy else None
+                key = source_key(doc.metadata) if doc is not None else entry.key
+                if not build_key_tokens([key]).isdisjoint(loaded_tokens):
+                    already_loaded.append(entry)
+                    continue
+                found.append((entry, doc if doc is not None else self._read_entry(entry)))
             except Exception as e:
-                print(f"⚠️  Skipping {cached_file.stem}: {e}")
+                print(f"⚠️  Skipping {entry.name}: {e}")
 
-        if not docs:
+        if not found:
             print("No cached documents found.")
-        return docs
-
+        return found, already_loaded
 
-    
-    
     def load_cached_docs(self):
+        """
+        Ingest the cached documents that changed since the last run. Cache entries
+        whose file size and mtime match the manifest are skipped without being read;
+        the rest are hashed and only re-split/added when their content changed.
+        """
         print("Loading cached documents...")
-        docs = self.get_cached_docs()
-        print(f"Found {len(docs)} cached documents.")
-        if docs:
-            chunks = self.split_documents(docs)
+        entries = self._cache_entries()
+        if not self.manifest.exists():
+            self._bootstrap_manifest(entries)
+            return
+
+        pruned = self.manifest.prune([entry.name for entry in entries])
+        changed = [entry for entry in entries if not self.manifest.is_current(entry.name, entry.file)]
+        if not changed:
+            print("✅ Cached documents unchanged since last run")
+            if pruned:
+                self.save_manifest()
+            return
+
+        print(f"Found {len(changed)} new or modified cached documents.")
+        for entry in changed:
+            content_hash = file_sha256(entry.file)
+            if self.manifest.has_hash(entry.name, content_hash):
+                # touched but identical: just refresh the stat
+                self.manifest.record(entry.name, entry.file, content_hash, None, None, self.generation)
+                continue
+            try:
+                doc = self._read_entry(entry)
+            except Exception as e:
+                print(f"⚠️  Skipping {entry.name}: {e}")
+                continue
+            chunks = self.split_documents([doc])
             self.add(chunks)
+            self.manifest.record(entry.name, entry.file, content_hash, source_key(doc.metadata), len(chunks), self.generation)
+
+        self.save_manifest()
+
+    def _bootstrap_manifest(self, entries: list[CacheEntry]):
+        # No manifest yet (fresh DB, or one built before manifests existed): fall back
+        # to matching cache entries against the loaded sources once. Only entries that were
+        # ingested or are already loaded are recorded; unreadable or failed ones stay
+        # out of the manifest so the next start retries them.
+        found, already_loaded = self._scan_cached()
+        print(f"Found {len(found)} cached documents.")
+        counts: dict[str, int | None] = {entry.name: None for entry in already_loaded}
+        for entry, doc in found:
+            try:
+                chunks = self.split_documents([doc])
+                self.add(chunks)
+            except Exception as e:
+                print(f"⚠️  Failed to ingest {entry.name}: {e}")
+                continue
+            counts[entry.name] = len(chunks)
+
+        for entry in entries:
+            if entry.name in counts:
+                self.manifest.record(entry.name, entry.file, file_sha256(entry.file), entry.key,
+                                     counts[entry.name], self.generation)
+        self.save_manifest()
+
+    def mark_converted_ingested(self, source_path: str, source: str | None, domain: str | None, chunk_count: int):
+        # Chunks of this file's conversion were added directly (IngestPipeline);
+        # note its cache entry in the manifest so the next load_cached_docs skips it
+        record = self.conversion_cache.record_path(self.conversion_cache.hash_of(source_path))
+        if record.exists() and source is not None:
+            entry = CacheEntry(record, source, domain)
+            self.manifest.record(entry.name, record, file_sha256(record), entry.key, chunk_count, self.generation)
+
+    def get_index_version(self) -> tuple:
+        """
+        Token that changes whenever the index does, in this process (generation)
+        or in another one sharing the DB directory (every ingest saves the
+        manifest, so its on-disk stamp moves). Costs one stat call.
+        """
+        return self.generation, self.manifest.stamp()
+
+    def save_manifest(self):
+        self.manifest.generation = self.generation
+        self.manifest.save()
+        if self._id_index is not None:
+            # our own write: the ID set already reflects it
+            self._id_index_stamp = self.manifest.stamp()
 
     def get_cached_src(self) -> list[str]:
-        return [fp.stem for fp in self._list_cache_files()]
+        return [entry.source for entry in self._cache_entries()]
 
-    def _list_cache_files(self) -> list[Path]:
+    def get_cached_keys(self) -> list[str]:
+        # util.source_key of every cached document; legacy JSON files are read for their domain
+        keys = []
+        for entry in self._cache_entries():
+            if not entry.is_legacy:
+                keys.append(entry.key)
+                continue
+            try:
+                keys.append(source_key(self.parse_json_to_document(str(entry.file)).metadata))
+            except Exception as e:
+                print(f"⚠️  Skipping {entry.name}: {e}")
+        return keys
+
+    def _cache_entries(self) -> list[CacheEntry]:
+        # One entry per (record, source, domain) plus any legacy <stem>.json files
+        entries = [CacheEntry(record, source, domain) for record, source, domain in self.conversion_cache.entries()]
         cache_path = Path(self.cache_dir)
-        if not cache_path.exists() or not cache_path.is_dir():
-            return []
-        return sorted(fp for fp in cache_path.glob("*.json") if fp.is_file())
+        if cache_path.is_dir():
+            entries.extend(CacheEntry(fp, fp.stem, None) for fp in sorted(cache_path.glob("*.json")) if fp.is_file())
+        return entries
+
+    def _list_cache_files(self) -> list[Path]:
+        return list(dict.fromkeys(entry.file for entry in self._cache_entries()))
 
     
     def clear_cache(self):
@@ -170,5 +541,7 @@ class Database:
             print("Cache directory does not exist.")
             return
 
-        shutil.rmtree(cache_path)
-        print("Cache cleared.")
\ No newline at end of file
+        self.conversion_cache.clear()
+        for legacy_file in cache_path.glob("*.json"):
+            legacy_file.unlink()
+        print("Cache cleared.")
@@ -8,35 +8,276 @@ from langchain_core.document_loaders import BaseLoader
 import json  # added
 import hashlib  # added
 import shutil
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait as futures_wait
+from concurrent.futures.process import BrokenProcessPool
+from conversion_cache import ConversionCache
 
 from enum_manager import *
 default_root = "data"
 
+
+def build_converter() -> DocumentConverter:
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = False # pick what you need  
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options, backend=DoclingParseV2DocumentBackend)
+        }
+    )
+
+
+# Each pool worker builds its converter once and keeps it warm for every file it gets
+_worker_converter: DocumentConverter | None = None
+
+def _init_worker():
+    global _worker_converter
+    # Parallelism comes from the worker processes; one torch thread each keeps
+    # N workers from each spinning up a full intra-op pool on the same cores
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    _worker_converter = build_converter()
+
+
+# Peak resident memory of one worker: its own Docling layout/table models plus a converting document
+WORKER_MEMORY_GB = 2.0
+
+
+def physical_memory_gb() -> float | None:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_conversion_workers(memory_limit_gb: float | None = None) -> int:
+    """
+    One single-threaded worker per core (one core left for the ingest threads),
+    capped so workers * WORKER_MEMORY_GB fits in memory_limit_gb, which defaults
+    to half the machine's physical memory. Without a memory reading, 2 workers.
+    """
+    cores = max(1, (os.cpu_count() or 1) - 1)
+    if memory_limit_gb is None:
+        total = physical_memory_gb()
+        if total is None:
+            return min(2, cores)
+        memory_limit_gb = total / 2
+    return max(1, min(cores, int(memory_limit_gb // WORKER_MEMORY_GB)))
+
+def _convert_in_worker(path: str) -> str:
+    return _worker_converter.convert(path).document.export_to_markdown()
+
+def _convert_pages_in_worker(path: str, start: int, end: int) -> list[tuple[int, str]]:
+    # Convert one page range and export it page by page so page numbers survive reassembly
+    docling_doc = _worker_converter.convert(path, page_range=(start, end)).document
+    pages = []
+    for page_no in range(start, end + 1):
+        text = docling_doc.export_to_markdown(page_no=page_no)
+        if text.strip():
+            pages.append((page_no, text))
+    return pages
+
+
+def count_pdf_pages(path: str) -> int:
+    if Path(path).suffix.lower() != ".pdf":
+        return 0
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except Exception as e:
+        print(f"⚠️  Could not count pages of {path}: {e}")
+        return 0
+
+
 class DoclingLoader(BaseLoader):
-    def __init__(self, path: str | list[str], cache_dir="data/cache"):
+    def __init__(self, path: str | list[str], cache_dir="data/cache", max_workers: int = 1,
+                 shard_threshold: int = 60, shard_pages: int = 20, max_in_flight: int | None = None):
         self._file_paths = path if isinstance(path,list) else [path]
-
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.do_ocr = False # pick what you need  
-        self._converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options, backend=DoclingParseV2DocumentBackend)
-            }
-        )
+        self._converter = None  # built lazily; parallel mode converts in the workers instead
         self.cache_dir = cache_dir
+        self.conversion_cache = ConversionCache(cache_dir)
+        self.max_workers = max(1, max_workers or 1)
+        # PDFs with more than shard_threshold pages are converted as shard_pages-sized page ranges
+        self.shard_threshold = shard_threshold
+        self.shard_pages = max(1, shard_pages)
+        # Conversions submitted to the pool but not yet consumed (default: 2 per worker)
+        self.max_in_flight = max_in_flight
 
-          
+    def _get_converter(self) -> DocumentConverter:
+        if self._converter is None:
+            self._converter = build_converter()
+        return self._converter
     
     def lazy_load(self):
+        for _, doc in self.lazy_load_with_paths():
+            yield doc
+
+    def lazy_load_with_paths(self):
+        # (source path, document) pairs; files whose bytes were converted before (under any path) come straight from the cache
+        pending = []
         for path in self._file_paths:
-            docling_doc = self._converter.convert(path).document
-            text = docling_doc.export_to_markdown()
-            domain = self.get_domain_from_path(path)
-            metadata = {"source": str(Path(path).stem), "domain": domain}
-            self.cache(text, metadata)
-            yield Document(page_content=text, metadata=metadata)
-
-    def get_domain_from_path(self,path: str) -> str | None:
+            cached = self.conversion_cache.get(path)
+            if cached is None:
+                pending.append(path)
+                continue
+            print(f"♻️  Reusing cached conversion of {Path(path).name}")
+            yield path, self._from_cache(path, cached)
+
+        if self.max_workers > 1:
+            tasks = self._plan_tasks(pending)
+            if len(tasks) > 1:
+                yield from self._parallel_lazy_load(tasks, len(pending))
+                return
+
+        for path in pending:
+            try:
+                text = self._get_converter().convert(path).document.export_to_markdown()
+            except Exception as e:
+                print(f"⚠️  Failed to convert {path}: {e}")
+                continue
+            yield path, self._to_document(path, text)
+
+    def _plan_tasks(self, paths: list[str]) -> list[tuple[str, int | None, int | None]]:
+        # (path, first_page, last_page); whole-file tasks have no page range
+        tasks = []
+        for path in paths:
+            pages = count_pdf_pages(path)
+            if pages > self.shard_threshold:
+                for start in range(1, pages + 1, self.shard_pages):
+                    tasks.append((path, start, min(start + self.shard_pages - 1, pages)))
+            else:
+                tasks.append((path, None, None))
+        return tasks
+
+    def _parallel_lazy_load(self, tasks, num_files: int):
+        # Yields documents in completion order; a failing file is reported and skipped
+        workers = min(self.max_workers, len(tasks))
+        print(f"Converting {num_files} files ({len(tasks)} tasks) with {workers} workers...")
+
+        shards_left = {}
+        shard_results: dict[str, dict[int, list[tuple[int, str]]]] = {}
+        failed = set()
+        for path, start, _ in tasks:
+            if start is not None:
+                shards_left[path] = shards_left.get(path, 0) + 1
+                shard_results.setdefault(path, {})
+
+        # Only a window of tasks is submitted; the next one goes in as each result is
+        # consumed, so a slow consumer never leaves every finished conversion in memory.
+        max_in_flight = max(workers, self.max_in_flight or 2 * workers)
+        remaining = deque(tasks)
+        futures = {}
+
+        def new_pool():
+            # spawn, not fork: the parent may have torch loaded (reranker warm-up) and
+            # ingest pipeline threads running, neither of which survives a fork safely
+            return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       mp_context=multiprocessing.get_context("spawn"))
+
+        def fill():
+            while remaining and len(futures) < max_in_flight:
+                task = remaining.popleft()
+                path, start, end = task
+                if path in failed:
+                    continue
+                try:
+                    if start is None:
+                        future = pool.submit(_convert_in_worker, path)
+                    else:
+                        future = pool.submit(_convert_pages_in_worker, path, start, end)
+                except BrokenProcessPool:
+                    # picked up (and the pool rebuilt) when the in-flight futures report it
+                    remaining.appendleft(task)
+                    return
+                futures[future] = task
+
+        pool = new_pool()
+        try:
+            fill()
+            while futures:
+                done, _ = futures_wait(futures, return_when=FIRST_COMPLETED)
+                future = next(iter(done))
+                path, start, _ = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died (segfault, OOM kill) and took every in-flight task with it;
+                    # those files are failed, the rest go to a fresh pool
+                    lost = {path} | {task[0] for task in futures.values()}
+                    print(f"⚠️  Conversion worker crashed ({e}); failed {len(lost)} in-flight files, restarting the pool")
+                    for lost_path in lost:
+                        print(f"⚠️  Failed to convert {lost_path}: worker crashed")
+                        shard_results.pop(lost_path, None)
+                    failed.update(lost)
+                    futures.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = new_pool()
+                    fill()
+                    continue
+                except Exception as e:
+                    if path not in failed:
+                        print(f"⚠️  Failed to convert {path}: {e}")
+                    failed.add(path)
+                    result = None
+                fill()
+
+                if start is None:
+                    if result is not None:
+                        yield path, self._to_document(path, result)
+                    continue
+
+                if path in failed:
+                    shard_results.pop(path, None)
+                    continue
+                shards_left[path] -= 1
+                shard_results[path][start] = result
+                if shards_left[path] == 0:
+                    yield path, self._assemble_shards(path, shard_results.pop(path))
+        finally:
+            pool.shutdown()
+
+    def _assemble_shards(self, path: str, shards: dict[int, list[tuple[int, str]]]) -> Document:
+        # Stitch the partial markdown back in page order, remembering where each page starts
+        parts, page_offsets, offset = [], [], 0
+        for start in sorted(shards):
+            for page_no, text in shards[start]:
+                if parts:
+                    offset += 2  # "\n\n" separator
+                page_offsets.append([offset, page_no])
+                parts.append(text)
+                offset += len(text)
+        return self._to_document(path, "\n\n".join(parts), page_offsets=page_offsets)
+
+    def _to_document(self, path: str, text: str, page_offsets: list | None = None) -> Document:
+        metadata = self._metadata_for(path)
+        if page_offsets:
+            metadata["page_offsets"] = page_offsets  # [[char_offset, page_no], ...]
+        self.cache(path, text, metadata)
+        return Document(page_content=text, metadata=metadata)
+
+    def _from_cache(self, path: str, cached: Document) -> Document:
+        # Same bytes may have been converted under another name/folder; label it for this path
+        metadata = self._metadata_for(path)
+        self.conversion_cache.label(path, metadata["source"], metadata["domain"])
+        if cached.metadata.get("page_offsets"):
+            metadata["page_offsets"] = cached.metadata["page_offsets"]
+        return Document(page_content=cached.page_content, metadata=metadata)
+
+    def _metadata_for(self, path: str) -> dict:
+        return {"source": str(Path(path).stem), "domain": self.get_domain_from_path(path)}
+
+    @staticmethod
+    def get_domain_from_path(path: str) -> str | None:
         p = Path(path).resolve()
         domain_map = {d.value.lower(): d for d in DOMAIN}
 
@@ -46,44 +287,24 @@ class DoclingLoader(BaseLoader):
                 return domain_map[name].value  # or domain_map[name].value
         return DOMAIN.ALL.value
     
-    def cache(self, content, metadata):
-        src = metadata.get("source", "unknown")
-        cache_path = Path(self.cache_dir)
-        cache_path.mkdir(parents=True, exist_ok=True)
+    def cache(self, path, content, metadata):
+        record = self.conversion_cache.put(path, content, metadata)
 
-        # Build deterministic, safe filename
+        # A legacy data/cache/<stem>.json for this source is superseded by the record
+        src = metadata.get("source", "unknown")
         base_name = "unknown" if src == "unknown" else Path(src).name
-        safe_name = base_name.replace(" ", "_")
-        file_name = f"{safe_name}.json"
-        file_path = cache_path / file_name
-
-        # Prepare JSON payload (note: key 'metdata' as specified)
-        payload = {
-            "content": content,
-            "metadata": metadata,
-        }
-
-        # If file exists with identical payload, skip rewrite
-        if file_path.exists():
-            try:
-                existing = json.loads(file_path.read_text(encoding="utf-8"))
-                if existing == payload:
-                    return file_path
-            except Exception:
-                pass  # proceed to overwrite if unreadable / malformed
+        legacy_path = Path(self.cache_dir) / f"{base_name.replace(' ', '_')}.json"
+        if legacy_path.exists():
+            legacy_path.unlink()
 
-        tmp_path = file_path.with_suffix(".tmp")
-        with tmp_path.open("w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        tmp_path.replace(file_path)
-
-        return file_path
+        return record
 
 class DocumentLoader:
     
-    def __init__(self, embed, cache_dir):
+    def __init__(self, embed, cache_dir, max_workers: int | None = None, memory_limit_gb: float | None = None):
         
         self.embed = embed
+        self.max_workers = max_workers or default_conversion_workers(memory_limit_gb)
     
         # Supported file extensions
         self.supported_extensions = {
@@ -94,27 +315,38 @@ class DocumentLoader:
 
 
 
-    def load_documents(self, root=default_root, loaded_files: list[str] | None = None):
-        files = self.get_all_files(root)
+    def load_documents(self, root=default_root, loaded_keys: list[str] | None = None):
+        loader = self._get_unloaded_loader(root, loaded_keys)
+        return loader.load() if loader else []
 
-        loaded_files = loaded_files or []
-        loaded_tokens = build_match_tokens(loaded_files)
+    def stream_documents(self, root=default_root, loaded_keys: list[str] | None = None, queue_size: int = 4):
+        # Lazily converted (path, document) pairs for IngestPipeline; at most
+        # max_workers + queue_size conversions are pending in the pool at a time
+        loader = self._get_unloaded_loader(root, loaded_keys)
+        if loader is None:
+            return iter(())
+        loader.max_in_flight = self.max_workers + queue_size
+        return loader.lazy_load_with_paths()
+
+    def _get_unloaded_loader(self, root=default_root, loaded_keys: list[str] | None = None) -> DoclingLoader | None:
+        # loaded_keys are util.source_key values, so data/econ/X.pdf loaded does not hide data/pyr/X.pdf
+        files = self.get_all_files(root)
+        loaded_tokens = build_key_tokens(loaded_keys or [])
 
         unloaded_files = [
             f for f in files
-            if build_match_tokens([f]).isdisjoint(loaded_tokens)
+            if build_key_tokens([source_key({"source": Path(f).stem, "domain": DoclingLoader.get_domain_from_path(f)})]).isdisjoint(loaded_tokens)
         ]
-        # print("[document_loader] files:", files)
-        print("[document_loader] loaded_files:", sorted(loaded_tokens))
+
+        print("[document_loader] loaded_keys:", sorted(loaded_tokens))
         # print("[document_loader] unloaded_files:", unloaded_files)
         
         if not unloaded_files:
             print("No new files to load.")
-            return []
+            return None
         
         # loader = PyPDFDirectoryLoader(root)
-        loader = DoclingLoader(unloaded_files,self.cache_dir)
-        return loader.load()
+        return DoclingLoader(unloaded_files, self.cache_dir, max_workers=self.max_workers)
 
     def get_all_files(self, root=default_root) -> list[str]:
         root_path = Path(root)
@@ -0,0 +1,265 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk, content-addressed embedding cache.
+
+    Rows are keyed by (embedding model, sha256 of the text) and store the
+    vector as packed float32 bytes. When the store grows past max_bytes the
+    least recently used rows are evicted.
+    """
+    def __init__(self, path: str | Path, max_bytes: int = 2 * 1024 ** 3):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._size = self._stored_bytes()  # running estimate, re-measured before evicting
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _pack(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # stay well below SQLite's host-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = self._unpack(blob)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, h, self._pack(v), now) for h, v in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._size += sum(len(row[2]) for row in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        size = self._stored_bytes()
+        self._size = size
+        if size <= self.max_bytes:
+            return
+        # Drop oldest rows until we are back under ~90% of the budget
+        target = int(self.max_bytes * 0.9)
+        freed, stale = 0, []
+        for model, h, length in self._conn.execute(
+            "SELECT model, hash, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        ):
+            if size - freed <= target:
+                break
+            stale.append((model, h))
+            freed += length
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND hash = ?", stale)
+        self._conn.commit()
+        self._size = size - freed
+        print(f"🧹 Evicted {len(stale)} cached embeddings ({freed / 1024 ** 2:.1f} MB)")
+
+    def clear(self, model: str | None = None, prefix: str | None = None):
+        with self._lock:
+            if model is not None:
+                self._conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            elif prefix is not None:
+                self._conn.execute("DELETE FROM embeddings WHERE substr(model, 1, ?) = ?", (len(prefix), prefix))
+            else:
+                self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._size = self._stored_bytes()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        return {"entries": count, "bytes": size}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts missing from the EmbeddingStore
+    to the underlying model. Re-indexing unchanged chunks costs no model calls.
+    """
+    def __init__(self, base: Embeddings, store: EmbeddingStore, model_name: str | None = None):
+        self.base = base
+        self.store = store
+        self.model_name = model_name or getattr(base, "model", type(base).__name__)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self) -> str:
+        return self.model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        cached = self.store.get_many(self.model_name, hashes)
+
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached:
+                missing.setdefault(h, t)
+
+        self.hits += sum(1 for h in hashes if h in cached)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model_name, fresh)
+            cached.update(fresh)
+
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.base.aembed_query(text)
+
+    def stats(self) -> Dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            **self.store.stats(),
+        }
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded in-memory LRU of query embeddings, optionally backed by an
+    EmbeddingStore so repeated questions survive restarts.
+    """
+    def __init__(self, max_entries: int = 1024, store: EmbeddingStore | None = None):
+        self.max_entries = max_entries
+        self.store = store
+        self._entries: "OrderedDict[tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, model: str, text: str, compute) -> List[float]:
+        vector = self._lookup(model, text)
+        if vector is None:
+            vector = compute(text)
+            self._remember(model, text, vector, persist=True)
+        return vector
+
+    async def aget_or_compute(self, model: str, text: str, acompute) -> List[float]:
+        vector = self._lookup(model, text)
+        if vector is None:
+            vector = await acompute(text)
+            self._remember(model, text, vector, persist=True)
+        return vector
+
+    def _lookup(self, model: str, text: str) -> List[float] | None:
+        key = (model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+        vector = None
+        if self.store is not None:
+            h = text_hash(text)
+            vector = self.store.get_many(f"query::{model}", [h]).get(h)
+
+        with self._lock:
+            if vector is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        if vector is not None:
+            self._remember(model, text, vector, persist=False)
+        return vector
+
+    def _remember(self, model: str, text: str, vector: List[float], persist: bool):
+        if persist and self.store is not None:
+            self.store.put_many(f"query::{model}", {text_hash(text): vector})
+        key = (model, text)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.store is not None:
+            # query vectors are namespaced as "query::<model>"
+            self.store.clear(prefix="query::")
+
+    def stats(self) -> Dict[str, int | float]:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+            }
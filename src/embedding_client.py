@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Sends document embeddings to the underlying model in fixed-size batches
+    with a bounded number of requests in flight, retrying failed batches with
+    exponential backoff. Keeps throughput counters for tuning.
+    """
+    def __init__(self, base: Embeddings, batch_size: int = 64, max_in_flight: int = 4,
+                 max_retries: int = 3, backoff: float = 0.5):
+        self.base = base
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.requests = 0
+        self.retries = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def model(self) -> str:
+        return getattr(self.base, "model", type(self.base).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_in_flight == 1:
+            results = [self._embed_batch(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as pool:
+                results = list(pool.map(self._embed_batch, batches))  # keeps input order
+
+        with self._lock:
+            self.chunks += len(texts)
+            self.busy_seconds += time.perf_counter() - start
+        return [vector for batch in results for vector in batch]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                with self._lock:
+                    self.requests += 1
+                return self.base.embed_documents(texts)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                print(f"⚠️  Embedding batch of {len(texts)} failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.base.aembed_query(text)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "requests": self.requests,
+                "retries": self.retries,
+                "chunks_per_second": self.chunks / self.busy_seconds if self.busy_seconds else 0.0,
+            }
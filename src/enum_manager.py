@@ -17,11 +17,12 @@ class EMBEDDING(Enum):
 class RagType(Enum):
     SIMPLE = "simple"
     MULTI_QUERY = "multi_query"
+    RAG_FUSION = "rag_fusion"
 
 RAG_TYPE_BUILDERS = {
     RagType.SIMPLE: simple_rag_chain,
     RagType.MULTI_QUERY: multi_query_chain,
-    # RagType.RAG_FUSION: rag_fusion_chain,
+    RagType.RAG_FUSION: rag_fusion_chain,
 }
 
 class DOMAIN(Enum):
@@ -32,4 +33,8 @@ class DOMAIN(Enum):
 
 class RERANKER(Enum):
     MACRO_MINI = "cross-encoder/ms-marco-MiniLM-L-6-v2"
-    # MACRO_MINI = "models/cross-encoder/ms-marco-MiniLM-L-6-v2"
\ No newline at end of file
+    # MACRO_MINI = "models/cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class RERANKER_BACKEND(Enum):
+    TORCH = "torch"
+    ONNX_INT8 = "onnx_int8"
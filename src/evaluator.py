@@ -145,6 +145,51 @@ class RetrievalEvaluator:
         
         return pd.DataFrame(results)
     
+    def cascade_report(self, test_queries: List[Dict] | None = None,
+                       margins: List[Tuple[float, float]] = [(0.05, 0.02), (0.10, 0.05), (0.15, 0.05), (0.20, 0.10)]) -> pd.DataFrame:
+        """
+        Compare full cross-encoder reranking with cascade reranking for several
+        (decisive_margin, band_margin) pairs: how many (query, chunk) pairs the
+        cascade kept away from the cross-encoder and what it cost in nDCG.
+        """
+        if test_queries is None:
+            with open("data/test_queries.json", "r", encoding="utf-8") as f:
+                test_queries = json.load(f)
+
+        original_rerank = self.rag.is_rerank
+        original = (self.rag.cascade_rerank, self.rag.cascade_decisive_margin, self.rag.cascade_band_margin)
+        results = []
+        try:
+            self.rag.is_rerank = True
+            configs = [(False, None, None)] + [(True, d, b) for d, b in margins]
+            baseline_ndcg = None
+            for enabled, decisive, band in configs:
+                self.rag.set_cascade_rerank(enabled, decisive, band)
+                before = self.rag.get_cascade_stats()  # counters are cumulative per reranker
+                metrics = self.evaluate_retrieval(test_queries)
+                after = self.rag.get_cascade_stats()
+                stats = {k: after.get(k, 0) - before.get(k, 0) for k in after}
+                total = stats.get("pairs_total", 0)
+                scored = stats.get("pairs_scored", 0)
+                if baseline_ndcg is None:
+                    baseline_ndcg = metrics['avg_ndcg']
+                results.append({
+                    'cascade': enabled,
+                    'decisive_margin': decisive,
+                    'band_margin': band,
+                    'pairs_total': total,
+                    'pairs_scored': scored,
+                    'pairs_avoided_pct': 100 * (total - scored) / total if total else 0.0,
+                    'skipped_queries': stats.get("skipped_queries", 0),
+                    'ndcg': metrics['avg_ndcg'],
+                    'ndcg_delta': metrics['avg_ndcg'] - baseline_ndcg,
+                })
+        finally:
+            self.rag.is_rerank = original_rerank
+            self.rag.set_cascade_rerank(*original)
+
+        return pd.DataFrame(results)
+
     def _precision_at_k(self, retrieved: List[str], relevant: set) -> float:
         if not retrieved:
             return 0.0
@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+from langchain_core.documents import Document
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.chunks = 0
+        self.busy = 0.0  # seconds spent working, not waiting on a queue
+        self.errors = 0
+
+    def as_dict(self) -> Dict[str, int | float]:
+        return {
+            "items": self.items,
+            "chunks": self.chunks,
+            "busy_seconds": self.busy,
+            "errors": self.errors,
+            "items_per_second": self.items / self.busy if self.busy else 0.0,
+            "chunks_per_second": self.chunks / self.busy if self.busy else 0.0,
+        }
+
+
+class IngestPipeline:
+    """
+    convert -> split -> embed -> upsert, one thread per stage joined by
+    bounded queues, so stages overlap and at most ~queue_size documents per
+    stage are in memory whatever the corpus size.
+
+    The embed stage pushes chunk texts through the DB's CachedEmbeddings;
+    by the time upsert calls add_documents every vector is a cache hit, so
+    the slow part never holds up Chroma writes. Each upserted conversion is
+    recorded in the ingestion manifest so the next startup skips it.
+    """
+    def __init__(self, db, queue_size: int = 4):
+        self.db = db
+        self.queue_size = max(1, queue_size)
+        self.stats = {
+            "convert": StageStats("convert", "docs"),
+            "split": StageStats("split", "docs"),
+            "embed": StageStats("embed", "docs"),
+            "upsert": StageStats("upsert", "docs"),
+        }
+
+    def _convert(self, items: Iterable[Tuple[str, Document]], out: queue.Queue):
+        stats = self.stats["convert"]
+        iterator = iter(items)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    path, doc = next(iterator)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    stats.errors += 1
+                    print(f"⚠️  Conversion stage stopped: {e}")
+                    break
+                stats.busy += time.perf_counter() - start
+                stats.items += 1
+                out.put((path, doc))
+        finally:
+            out.put(_DONE)
+
+    def _split(self, inbox: queue.Queue, out: queue.Queue):
+        stats = self.stats["split"]
+        try:
+            while (item := inbox.get()) is not _DONE:
+                path, doc = item
+                start = time.perf_counter()
+                try:
+                    chunks = self.db.split_documents([doc])
+                except Exception as e:
+                    stats.errors += 1
+                    print(f"⚠️  Failed to split {path}: {e}")
+                    continue
+                finally:
+                    stats.busy += time.perf_counter() - start
+                stats.items += 1
+                stats.chunks += len(chunks)
+                out.put((path, doc.metadata, chunks))
+        finally:
+            out.put(_DONE)
+
+    def _embed(self, inbox: queue.Queue, out: queue.Queue):
+        stats = self.stats["embed"]
+        try:
+            while (item := inbox.get()) is not _DONE:
+                path, _, chunks = item
+                start = time.perf_counter()
+                try:
+                    # Warm the embedding cache; the vectors themselves are not needed here
+                    self.db.embed.embed_documents([chunk.page_content for chunk in chunks])
+                except Exception as e:
+                    stats.errors += 1
+                    print(f"⚠️  Failed to embed {path}: {e}")  # upsert will retry through add_documents
+                finally:
+                    stats.busy += time.perf_counter() - start
+                stats.items += 1
+                stats.chunks += len(chunks)
+                out.put(item)
+        finally:
+            out.put(_DONE)
+
+    def _upsert(self, inbox: queue.Queue):
+        stats = self.stats["upsert"]
+        while (item := inbox.get()) is not _DONE:
+            path, metadata, chunks = item
+            start = time.perf_counter()
+            try:
+                if chunks:
+                    self.db.add(chunks)
+                self.db.mark_converted_ingested(path, metadata.get("source"), metadata.get("domain"), len(chunks))
+            except Exception as e:
+                stats.errors += 1
+                print(f"⚠️  Failed to upsert {path}: {e}")
+                continue
+            finally:
+                stats.busy += time.perf_counter() - start
+            stats.items += 1
+            stats.chunks += len(chunks)
+
+    def run(self, items: Iterable[Tuple[str, Document]]) -> Dict[str, Dict[str, int | float]]:
+        """items: (source path, converted document) pairs, typically DoclingLoader.lazy_load_with_paths()"""
+        converted = queue.Queue(maxsize=self.queue_size)
+        split = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+
+        threads = [
+            threading.Thread(target=self._convert, args=(items, converted), name="ingest-convert", daemon=True),
+            threading.Thread(target=self._split, args=(converted, split), name="ingest-split", daemon=True),
+            threading.Thread(target=self._embed, args=(split, embedded), name="ingest-embed", daemon=True),
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        self._upsert(embedded)  # Chroma writes stay on the calling thread
+        for thread in threads:
+            thread.join()
+        self.db.save_manifest()
+
+        self.report(time.perf_counter() - start)
+        return self.get_stats()
+
+    def get_stats(self) -> Dict[str, Dict[str, int | float]]:
+        return {name: stage.as_dict() for name, stage in self.stats.items()}
+
+    def report(self, wall_seconds: Optional[float] = None):
+        for stage in self.stats.values():
+            s = stage.as_dict()
+            print(f"📊 {stage.name:>7}: {stage.items} {stage.unit}, {stage.chunks} chunks in {s['busy_seconds']:.1f}s "
+                  f"({s['items_per_second']:.2f} {stage.unit}/s, {s['chunks_per_second']:.1f} chunks/s, {stage.errors} errors)")
+        if wall_seconds is not None:
+            print(f"⏱️  Ingest wall time: {wall_seconds:.1f}s")
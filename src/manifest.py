@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def file_sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    Record of what has been ingested from the conversion cache, stored next
+    to the vector DB:
+
+        {"generation": 7,
+         "files": {"<cache entry name>": {"mtime_ns", "size", "content_hash",
+                                          "source", "chunk_count", "generation"}}}
+
+    Entries are named by the caller (a cache file may back several sources).
+    On startup an entry whose file still has the recorded (mtime_ns, size) is
+    trusted without being opened.
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.generation = 0
+        self.files: dict[str, dict] = {}
+        self._exists = False
+        if self.path.exists():
+            try:
+                raw = json.loads(self.path.read_text(encoding="utf-8"))
+                self.generation = int(raw.get("generation", 0))
+                self.files = raw.get("files", {})
+                self._exists = True
+            except Exception as e:
+                print(f"⚠️  Ignoring unreadable manifest {self.path}: {e}")
+
+    def exists(self) -> bool:
+        return self._exists
+
+    def stamp(self) -> tuple[int, int] | None:
+        # (mtime_ns, size) of the file on disk; changes whenever any process saves or clears it
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def _stat(path: Path) -> tuple[int, int]:
+        st = path.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def is_current(self, name: str, path: Path) -> bool:
+        entry = self.files.get(name)
+        if entry is None:
+            return False
+        return (entry["mtime_ns"], entry["size"]) == self._stat(path)
+
+    def has_hash(self, name: str, content_hash: str) -> bool:
+        entry = self.files.get(name)
+        return entry is not None and entry.get("content_hash") == content_hash
+
+    def record(self, name: str, path: Path, content_hash: str, source: str | None, chunk_count: int | None, generation: int):
+        mtime_ns, size = self._stat(path)
+        previous = self.files.get(name, {})
+        self.files[name] = {
+            "mtime_ns": mtime_ns,
+            "size": size,
+            "content_hash": content_hash,
+            "source": source if source is not None else previous.get("source"),
+            "chunk_count": chunk_count if chunk_count is not None else previous.get("chunk_count"),
+            "generation": generation,
+        }
+
+    def prune(self, names: list[str]) -> bool:
+        # Forget cache entries that no longer exist; returns True if anything was dropped
+        keep = set(names)
+        stale = [name for name in self.files if name not in keep]
+        for name in stale:
+            del self.files[name]
+        return bool(stale)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"generation": self.generation, "files": self.files}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._exists = True
+
+    def clear(self):
+        self.files = {}
+        self._exists = False
+        if self.path.exists():
+            self.path.unlink()
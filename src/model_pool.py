@@ -0,0 +1,74 @@
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from langchain_community.cross_encoders.base import BaseCrossEncoder
+
+
+class CrossEncoderPool:
+    """
+    Process-wide registry of loaded cross-encoders.
+
+    Models are keyed by (model_name, backend, model_kwargs) so the same weights
+    are only read from disk once per process, no matter how many retrievers,
+    chains or evaluator runs ask for them.
+    """
+    def __init__(self):
+        self._models: Dict[Tuple, BaseCrossEncoder] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self.loads = 0
+        self.hits = 0
+
+    @staticmethod
+    def _key(model_name: str, model_kwargs: Optional[Dict[str, Any]], backend: str) -> Tuple:
+        kwargs = model_kwargs or {}
+        return (model_name, backend, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+
+    @staticmethod
+    def _load(model_name: str, model_kwargs: Dict[str, Any], backend: str) -> BaseCrossEncoder:
+        if backend == "onnx_int8":
+            from onnx_cross_encoder import OnnxCrossEncoder
+            return OnnxCrossEncoder(model_name, quantize=True, **model_kwargs)
+        return HuggingFaceCrossEncoder(model_name=model_name, model_kwargs=model_kwargs)
+
+    def get(self, model_name: str, model_kwargs: Optional[Dict[str, Any]] = None, backend: str = "torch") -> BaseCrossEncoder:
+        key = self._key(model_name, model_kwargs, backend)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so different models can load in parallel,
+        # but only one thread loads any given model.
+        with key_lock:
+            with self._lock:
+                model = self._models.get(key)
+                if model is not None:
+                    self.hits += 1
+                    return model
+
+            print(f"⏳ Loading cross-encoder: {model_name} ({backend})")
+            model = self._load(model_name, dict(model_kwargs or {}), backend)
+
+            with self._lock:
+                self._models[key] = model
+                self.loads += 1
+            return model
+
+    def warm_up(self, model_names: Iterable[str], model_kwargs: Optional[Dict[str, Any]] = None, backend: str = "torch"):
+        for name in model_names:
+            self.get(name, model_kwargs, backend)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._key_locks.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"loaded": len(self._models), "loads": self.loads, "hits": self.hits}
+
+
+cross_encoder_pool = CrossEncoderPool()
@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+from langchain_community.cross_encoders.base import BaseCrossEncoder
+
+default_onnx_dir = "models/onnx"
+
+
+def export_onnx(model_name: str, out_dir: str = default_onnx_dir, quantize: bool = True) -> Path:
+    """
+    Export a Hugging Face cross-encoder to ONNX (once) and optionally apply
+    dynamic int8 quantization. Returns the path of the model to load.
+    """
+    target_dir = Path(out_dir) / model_name.replace("/", "__")
+    fp32_path = target_dir / "model.onnx"
+    int8_path = target_dir / "model.int8.onnx"
+    target = int8_path if quantize else fp32_path
+    if target.exists():
+        return target
+
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    print(f"⏳ Exporting {model_name} to ONNX...")
+    target_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(target_dir)
+
+    if not fp32_path.exists():
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        dummy = tokenizer(["query"], ["document"], return_tensors="pt")
+        names = list(dummy.keys())
+
+        class _LogitsOnly(torch.nn.Module):
+            # Positional ONNX inputs -> keyword arguments the HF model expects
+            def __init__(self, inner):
+                super().__init__()
+                self.inner = inner
+
+            def forward(self, *args):
+                return self.inner(**dict(zip(names, args))).logits
+
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+        dynamic_axes["logits"] = {0: "batch"}
+        torch.onnx.export(
+            _LogitsOnly(model),
+            tuple(dummy[name] for name in names),
+            str(fp32_path),
+            input_names=names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    return target
+
+
+class OnnxCrossEncoder(BaseCrossEncoder):
+    """
+    Cross-encoder served by onnxruntime on CPU, typically from an int8
+    quantized export. Drop-in for HuggingFaceCrossEncoder in the rerankers.
+    """
+    def __init__(self, model_name: str, onnx_dir: str = default_onnx_dir, quantize: bool = True,
+                 batch_size: int = 32, num_threads: int | None = None, max_length: int = 512):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.max_length = max_length
+        model_path = export_onnx(model_name, onnx_dir, quantize=quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path.parent)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        scores: List[float] = []
+        for i in range(0, len(text_pairs), self.batch_size):
+            batch = text_pairs[i:i + self.batch_size]
+            encoded = self.tokenizer(
+                [q for q, _ in batch],
+                [d for _, d in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feed = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+            logits = self.session.run(None, feed)[0]
+            # same convention as HuggingFaceCrossEncoder: single logit, or the positive class
+            column = logits[:, 0] if logits.shape[1] == 1 else logits[:, 1]
+            scores.extend(float(s) for s in column)
+        return scores
@@ -1,6 +1,7 @@
 from dotenv import load_dotenv
 from db import Database
-from document_loader import DocumentLoader
+from document_loader import DocumentLoader, DoclingLoader
+from ingest_pipeline import IngestPipeline
 from dotenv import load_dotenv
 import os
 from langchain_ollama import ChatOllama,OllamaEmbeddings
@@ -12,14 +13,17 @@ from langchain.retrievers import ContextualCompressionRetriever
 from enum_manager import *
 from router import ManualDomainRouter
 from retriever import BasicRetriever, DomainRetriever
-from reranker import CrossEncoderRerankerWithScores
+from reranker import CrossEncoderRerankerWithScores, rerank_score_cache
+from model_pool import cross_encoder_pool
+from answer_cache import SemanticAnswerCache
+from context_packer import ContextPacker
 from pathlib import Path
 import pandas as pd
 from typing import List, Dict
 
 
 class Rag:
-    def __init__(self):
+    def __init__(self, conversion_workers: int | None = None, conversion_memory_gb: float | None = None):
         if not load_dotenv():
             print(".env file not found")
 
@@ -30,7 +34,13 @@ class Rag:
 
         # DB
         self.cache_dir = "data/cache"
-        self.document_loader = DocumentLoader(embed = self.embed, cache_dir=self.cache_dir)
+        # Docling worker processes: explicit count, else as many as cores allow within the
+        # memory limit (RAG_CONVERSION_MEMORY_GB, default half of physical memory)
+        conversion_workers = conversion_workers or int(os.getenv("RAG_CONVERSION_WORKERS") or 0) or None
+        if conversion_memory_gb is None and os.getenv("RAG_CONVERSION_MEMORY_GB"):
+            conversion_memory_gb = float(os.getenv("RAG_CONVERSION_MEMORY_GB"))
+        self.document_loader = DocumentLoader(embed = self.embed, cache_dir=self.cache_dir,
+                                              max_workers=conversion_workers, memory_limit_gb=conversion_memory_gb)
 
         self.db_dir = "db"
         self.db = Database(self.embed, self.db_dir, self.cache_dir)
@@ -41,10 +51,32 @@ class Rag:
         self.threshold = 0
         self.is_rerank = True
         self.reranker = RERANKER.MACRO_MINI.value
+        self.reranker_backend = RERANKER_BACKEND.TORCH.value
+        self.onnx_batch_size = 32  # pairs per onnxruntime call (onnx_int8 backend)
+        self.onnx_num_threads = None  # onnxruntime intra-op threads; None = all cores
+        self.cascade_rerank = False  # skip / narrow the cross-encoder when vector scores are decisive
+        self.cascade_decisive_margin = 0.15
+        self.cascade_band_margin = 0.05
+
+        # CONTEXT PACKING (token budget for retrieved chunks in the prompt)
+        self.context_token_budget = 3000
+        self._context_packer = None
 
         # ROUTER
         self.domain_router = ManualDomainRouter(domain = DOMAIN.ALL.value)
 
+        # ANSWER CACHE (near-duplicate questions reuse the previous response)
+        # Opt-in: questions differing only in an entity or a year can embed very close
+        # together, so a match must be near-exact to be worth returning someone else's answer.
+        self.use_answer_cache = False
+        self.answer_cache = SemanticAnswerCache(threshold=0.98, ttl_seconds=3600, max_entries=512)
+
+        # COMPILED CHAIN CACHE (rebuilt only when the config key changes)
+        self._chain = None
+        self._chain_key = None
+        self._retriever = None
+        self._retriever_key = None
+
         # INIT
         self.load_cached_documents()
 
@@ -52,18 +84,19 @@ class Rag:
         self.db.load_cached_docs()
 
 
-    def load_documents(self):
-        loaded = self.get_loaded_src()
-        cached = self.db.get_cached_src()
-        processed = set(loaded + cached)
+    def load_documents(self, queue_size: int = 4):
+        """
+        Convert, split, embed and upsert every new file under data/ as a
+        streaming pipeline, then pick up anything left in the cache.
+        Returns the per-stage throughput counters.
+        """
+        # Matched per util.source_key, so a stem loaded in one domain still loads in another
+        processed = set(self.db.get_loaded_keys() + self.db.get_cached_keys())
 
-        self.document_loader.load_documents(loaded_files=[Path(file).stem for file in processed])
-
-        # if docs:
-        #     chunks = self.db.split_documents(docs)
-        #     self.db.add(chunks)
-        # return docs
-        return self.load_cached_documents()
+        docs = self.document_loader.stream_documents(loaded_keys=list(processed), queue_size=queue_size)
+        stats = IngestPipeline(self.db, queue_size=queue_size).run(docs)
+        self.load_cached_documents()
+        return stats
     
     # def load_documents(self):
     #     loaded = self.get_loaded_src()
@@ -74,12 +107,30 @@ class Rag:
     #     return docs
 
     
+    def reindex_documents(self, paths: list[str]):
+        """
+        Re-convert the given files and sync their chunks into the DB. Only the
+        chunks whose content changed are embedded; vanished ones are deleted.
+        The sync goes through the manifest, so files whose conversion did not
+        change are not re-split.
+        """
+        # Same worker pool size as load_documents, so large PDFs are sharded across it
+        docs = DoclingLoader(paths, self.cache_dir, max_workers=self.document_loader.max_workers).load()
+        if docs:
+            self.load_cached_documents()
+        return docs
+
     def get_loaded_src(self):
         return self.db.get_loaded_src()
+
+    def delete_source(self, source: str, domain: str | None = None) -> int:
+        return self.db.delete_source(source, domain)
     
     def clear_db(self):
         self.db.clear()
         self.db = Database(self.embed, self.db_dir, self.cache_dir)
+        self.invalidate_chain()
+        self.answer_cache.clear()
 
     def invoke_simplify(self, query):
         response = self.invoke(query)
@@ -89,24 +140,145 @@ class Rag:
         return answer, docs
 
     def invoke(self, query):
-        builder = self.get_rag_type_builder()
-        final_chain = builder(self.get_llm(), self.get_retriever())
-        
-        response = final_chain.invoke(query)
+        embedding = self.db.embed_query(query) if self.use_answer_cache else None
+        cached = self._lookup_answer(embedding)
+        if cached is not None:
+            return cached
+
+        response = self.get_chain().invoke(query)
+        self._store_answer(embedding, response)
         return response
 
+    def stream(self, query):
+        """
+        Yields {"docs": [...]} as soon as retrieval (and reranking) finishes,
+        then {"answer": "<token>"} chunks as the LLM generates them.
+        """
+        embedding = self.db.embed_query(query) if self.use_answer_cache else None
+        cached = self._lookup_answer(embedding)
+        if cached is not None:
+            yield {"docs": cached["docs"]}
+            yield {"answer": cached["answer"]}
+            return
+
+        docs, answer = [], []
+        for chunk in self.get_chain().stream(query):
+            if "docs" in chunk:
+                docs = chunk["docs"]
+            if chunk.get("answer"):
+                answer.append(chunk["answer"])
+            yield chunk
+        self._store_answer(embedding, {"answer": "".join(answer), "docs": docs})
+
+    async def ainvoke(self, query):
+        # Retrieval, reranking (thread pool) and the Ollama call all yield to the event loop,
+        # so one worker can overlap many in-flight queries.
+        embedding = await self.db.aembed_query(query) if self.use_answer_cache else None
+        cached = self._lookup_answer(embedding)
+        if cached is not None:
+            return cached
+
+        response = await self.get_chain().ainvoke(query)
+        self._store_answer(embedding, response)
+        return response
+
+    def _lookup_answer(self, embedding):
+        if embedding is None:
+            return None
+        return self.answer_cache.lookup(embedding, self.get_chain_key(), self.db.get_index_version())
+
+    def _store_answer(self, embedding, response):
+        if embedding is None:
+            return
+        self.answer_cache.store(embedding, self.get_chain_key(), self.db.get_index_version(), response)
+
+    def get_context_packer(self):
+        packer = self._context_packer
+        if packer is None or packer.model_name != self.llm.model or packer.token_budget != self.context_token_budget:
+            self._context_packer = ContextPacker(self.llm.model, token_budget=self.context_token_budget)
+        return self._context_packer
+
+    def set_context_token_budget(self, budget: int):
+        self.context_token_budget = budget
+
+    def get_context_packing_stats(self):
+        return self.get_context_packer().stats()
+
+    def set_answer_cache_threshold(self, threshold: float):
+        self.answer_cache.threshold = threshold
+
+    def set_conversion_workers(self, n: int):
+        self.document_loader.max_workers = max(1, n)
+
+    def set_use_answer_cache(self, enabled: bool):
+        self.use_answer_cache = enabled
+
+    def clear_answer_cache(self):
+        self.answer_cache.clear()
+
+    def get_chain(self):
+        key = self.get_chain_key()
+        if self._chain is None or key != self._chain_key:
+            builder = self.get_rag_type_builder()
+            self._chain = builder(self.get_llm(), self.get_retriever(), packer=self.get_context_packer())
+            self._chain_key = key
+        return self._chain
+
+    def get_chain_key(self):
+        return (self.rag_type, self.llm.model, self.context_token_budget, *self.get_retriever_key())
+
+    def get_retriever_key(self):
+        # id(self.db) so a cleared / recreated Database never reuses a stale retriever
+        return (
+            self.embed.model,
+            self.retrieve_num,
+            self.threshold,
+            self.top_n,
+            self.is_rerank,
+            self.reranker,
+            self.reranker_backend,
+            self.onnx_batch_size,
+            self.onnx_num_threads,
+            self.cascade_rerank,
+            self.cascade_decisive_margin,
+            self.cascade_band_margin,
+            self.domain_router.domain,
+            id(self.db),
+        )
+
+    def invalidate_chain(self):
+        self._chain = None
+        self._chain_key = None
+        self._retriever = None
+        self._retriever_key = None
+
     def get_retriever(self):
+        key = self.get_retriever_key()
+        if self._retriever is None or key != self._retriever_key:
+            self._retriever = self.build_retriever()
+            self._retriever_key = key
+        return self._retriever
+
+    def build_retriever(self):
         basic_retriever = self.get_basic_retriever(self.retrieve_num, self.threshold)
         if self.is_rerank:
-            return self.get_rank_retriever(basic_retriever, model_name=self.reranker, top_n=self.top_n)
+            return self.get_rank_retriever(basic_retriever, model_name=self.reranker, top_n=self.top_n,
+                                           backend=self.reranker_backend, model_kwargs=self.get_reranker_model_kwargs())
         return basic_retriever
 
     def get_basic_retriever(self, k=20, threshold=0.5):
         return DomainRetriever(db=self.db, router=self.domain_router, k=k, threshold=threshold)
 
-    def get_rank_retriever(self, retriever,  model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", top_n=5): 
-        cross_encoder = HuggingFaceCrossEncoder(model_name=model_name)
-        reranker = CrossEncoderRerankerWithScores(model=cross_encoder, top_n=top_n)
+    def get_rank_retriever(self, retriever,  model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", top_n=5, backend="torch", model_kwargs=None): 
+        reranker = CrossEncoderRerankerWithScores.from_model_name(
+            model_name,
+            top_n=top_n,
+            model_kwargs=model_kwargs,
+            backend=backend,
+            cascade=self.cascade_rerank,
+            decisive_margin=self.cascade_decisive_margin,
+            band_margin=self.cascade_band_margin,
+        )
 
         rank_retriever = ContextualCompressionRetriever(
             base_retriever=retriever,
@@ -114,12 +286,51 @@ class Rag:
         )
         return rank_retriever
     
+    def warm_up_reranker(self):
+        # Optional: load the cross-encoder now instead of on the first query
+        cross_encoder_pool.warm_up([self.reranker], self.get_reranker_model_kwargs(), backend=self.reranker_backend)
+
+    def get_reranker_model_kwargs(self):
+        if self.reranker_backend == RERANKER_BACKEND.ONNX_INT8.value:
+            return {"batch_size": self.onnx_batch_size, "num_threads": self.onnx_num_threads}
+        return None
+
+    def get_reranker_stats(self):
+        return cross_encoder_pool.stats()
+
+    def get_rerank_score_cache_stats(self):
+        return rerank_score_cache.stats()
+
     def clear_cache(self):
         self.db.clear_cache()
 
     def set_domain(self, domain: DOMAIN):
         self.domain_router.set_domain(domain)
 
+    def set_reranker_backend(self, backend: RERANKER_BACKEND):
+        self.reranker_backend = backend.value
+
+    def get_reranker_backend(self):
+        return self.reranker_backend
+
+    def set_onnx_options(self, batch_size: int | None = None, num_threads: int | None = None):
+        if batch_size is not None:
+            self.onnx_batch_size = batch_size
+        if num_threads is not None:
+            self.onnx_num_threads = num_threads
+
+    def set_cascade_rerank(self, enabled: bool, decisive_margin: float | None = None, band_margin: float | None = None):
+        self.cascade_rerank = enabled
+        if decisive_margin is not None:
+            self.cascade_decisive_margin = decisive_margin
+        if band_margin is not None:
+            self.cascade_band_margin = band_margin
+
+    def get_cascade_stats(self):
+        retriever = self.get_retriever()
+        compressor = getattr(retriever, "base_compressor", None)
+        return dict(getattr(compressor, "cascade_stats", {}))
+
     def set_top_n(self,n):
         self.top_n = n
     
@@ -169,6 +380,7 @@ class Rag:
     
     def set_embedding(self, embed: EMBEDDING):
         self.embed = OllamaEmbeddings(model = embed.value)
+        self.db.clear_query_cache()
 
     def to_string(self):
         return f"RAG Type: {self.rag_type.name}, LLM: {self.llm.model}, Embedding: {self.embed.model}"
@@ -185,3 +397,9 @@ class Rag:
         from evaluator import RetrievalEvaluator
         evaluator = RetrievalEvaluator(self)
         return evaluator.benchmark_different_settings(test_queries)
+
+    def benchmark_cascade_rerank(self) -> pd.DataFrame:
+        """Cross-encoder pairs avoided vs. nDCG lost by cascade reranking"""
+        from evaluator import RetrievalEvaluator
+        evaluator = RetrievalEvaluator(self)
+        return evaluator.cascade_report()
@@ -1,31 +1,196 @@
 from typing import List, Sequence, Tuple, Optional, Dict, Any
 from langchain_core.documents import Document
 from langchain.retrievers.document_compressors import CrossEncoderReranker
+from pydantic import Field
+from model_pool import cross_encoder_pool
+from util import confidence_label
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import OrderedDict
+import asyncio
+import hashlib
 import math
+import os
+import threading
+
+# Cross-encoder scoring is CPU-bound; async callers share this bounded pool so
+# concurrent queries don't all run the model at once or block the event loop.
+_rerank_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="rerank")
+
+
+class RerankScoreCache:
+    """
+    Bounded LRU of cross-encoder logits keyed by (model, normalized query,
+    content hash). Keying on the chunk text means edited chunks never reuse
+    a stale score.
+    """
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self._scores: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, query: str, content: str) -> Tuple[str, str, str]:
+        # The MiniLM cross-encoder is uncased, so case and spacing don't change its score
+        normalized = " ".join(query.lower().split())
+        return (model_name, normalized, hashlib.sha256(content.encode("utf-8")).hexdigest())
+
+    def get_many(self, keys: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], float]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    found[key] = score
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[Tuple[str, str, str], float]):
+        with self._lock:
+            for key, score in items.items():
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> Dict[str, int | float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._scores),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+rerank_score_cache = RerankScoreCache()
 
 
 class CrossEncoderRerankerWithScores(CrossEncoderReranker):
     """
     Same behavior as CrossEncoderReranker, but also writes `rerank_score` into
     each returned Document's metadata and preserves existing metadata.
+    Only (query, chunk) pairs missing from `score_cache` are sent to the model.
+
+    With `cascade` on, candidates carrying a vector `similarity_score` are only
+    partly reranked: if the similarity gap at the top_n cut-off is at least
+    `decisive_margin` the cross-encoder is skipped entirely, otherwise only the
+    candidates within `band_margin` of the cut-off are scored.
     """
-    def compress_documents(self, documents: Sequence[Document], query: str, **kwargs) -> Sequence[Document]:
-        # score all candidates at once (implementation may batch internally)
-        pairs = [(query, d.page_content) for d in documents]
-        scores: List[float] = self.model.score(pairs)  # 1 score per (query, doc) pair
+    model_name: str = ""
+    backend: str = "torch"
+    score_cache: Optional[RerankScoreCache] = None
+    cascade: bool = False
+    decisive_margin: float = 0.15
+    band_margin: float = 0.05
+    cascade_stats: Dict[str, int] = Field(default_factory=lambda: {
+        "queries": 0, "skipped_queries": 0, "pairs_total": 0, "pairs_scored": 0,
+    })
+
+    @classmethod
+    def from_model_name(cls, model_name: str, top_n: int = 5, model_kwargs: Optional[Dict[str, Any]] = None,
+                        backend: str = "torch", **kwargs) -> "CrossEncoderRerankerWithScores":
+        # Reuse the process-wide model instead of reloading the weights per query
+        return cls(
+            model=cross_encoder_pool.get(model_name, model_kwargs, backend),
+            top_n=top_n,
+            model_name=model_name,
+            backend=backend,
+            score_cache=rerank_score_cache,
+            **kwargs,
+        )
+
+    def score_documents(self, documents: Sequence[Document], query: str) -> List[float]:
+        if self.score_cache is None:
+            return list(self.model.score([(query, d.page_content) for d in documents]))
+
+        # quantized backends score slightly differently, so they get their own entries
+        cache_model = f"{self.model_name}:{self.backend}"
+        keys = [self.score_cache.make_key(cache_model, query, d.page_content) for d in documents]
+        cached = self.score_cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if missing:
+            fresh = self.model.score([(query, documents[i].page_content) for i in missing])
+            new_scores = {keys[i]: float(s) for i, s in zip(missing, fresh)}
+            self.score_cache.put_many(new_scores)
+            cached.update(new_scores)
+        return [cached[key] for key in keys]
+
+    def compress_documents(self, documents: Sequence[Document], query: str, cascade: bool = True, **kwargs) -> Sequence[Document]:
+        # cascade=False forces a full rerank, e.g. when similarity scores come from different queries
+        if cascade and self._can_cascade(documents):
+            return self._cascade_compress(documents, query)
+        self._count(len(documents), len(documents))
+
+        # score all uncached candidates at once (implementation may batch internally)
+        scores: List[float] = self.score_documents(documents, query)  # 1 score per (query, doc) pair
         ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)[: self.top_n]
+        return [self._annotate(doc, s) for doc, s in ranked]
+
+    def _annotate(self, doc: Document, s: float) -> Document:
+        point = self._sigmoid(s)
+        doc.metadata["rerank_score"] = float(s)
+        doc.metadata["confidence"] = self._to_confidence(point)
+        doc.metadata["confidence_label"] = self._label(point)
+        return doc
+
+    def _annotate_from_similarity(self, doc: Document) -> Document:
+        # Not cross-encoded: fall back to the vector relevance score (already 0..1)
+        point = self._to_confidence(doc.metadata["similarity_score"])
+        doc.metadata["confidence"] = point
+        doc.metadata["confidence_label"] = self._label(point)
+        return doc
+
+    def _can_cascade(self, documents: Sequence[Document]) -> bool:
+        return (
+            self.cascade
+            and len(documents) > self.top_n
+            and all("similarity_score" in d.metadata for d in documents)
+        )
 
-        docs: List[Document] = []
-        for doc, s in ranked:
-            point = self._sigmoid(s)
-            doc.metadata["rerank_score"] = float(s)
-            doc.metadata["confidence"] = self._to_confidence(point)
-            doc.metadata["confidence_label"] = "high" if point >= 0.80 else "medium" if point >= 0.60 else "low"
-            
-            
-            docs.append(doc)
-        return docs
+    def _cascade_compress(self, documents: Sequence[Document], query: str) -> List[Document]:
+        candidates = sorted(documents, key=lambda d: d.metadata["similarity_score"], reverse=True)
+        sims = [d.metadata["similarity_score"] for d in candidates]
+        cutoff = sims[self.top_n - 1]
+
+        # Decisive: the top_n are clearly separated from the rest, keep the vector order
+        if cutoff - sims[self.top_n] >= self.decisive_margin:
+            self._count(len(documents), 0)
+            return [self._annotate_from_similarity(d) for d in candidates[: self.top_n]]
+
+        # Otherwise only the ambiguous band around the cut-off goes through the cross-encoder
+        head = [d for d, s in zip(candidates, sims) if s > cutoff + self.band_margin]
+        band = [d for d, s in zip(candidates, sims) if cutoff - self.band_margin <= s <= cutoff + self.band_margin]
+        self._count(len(documents), len(band))
+
+        scores = self.score_documents(band, query)
+        ranked = sorted(zip(band, scores), key=lambda x: x[1], reverse=True)[: self.top_n - len(head)]
+        return [self._annotate_from_similarity(d) for d in head] + [self._annotate(d, s) for d, s in ranked]
+
+    def _count(self, total: int, scored: int):
+        self.cascade_stats["queries"] += 1
+        self.cascade_stats["pairs_total"] += total
+        self.cascade_stats["pairs_scored"] += scored
+        if scored == 0:
+            self.cascade_stats["skipped_queries"] += 1
+
+    async def acompress_documents(self, documents: Sequence[Document], query: str, **kwargs) -> Sequence[Document]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_rerank_executor, partial(self.compress_documents, documents, query, **kwargs))
     
+    @staticmethod
+    def _label(point: float) -> str:
+        return confidence_label(point)
+
     @staticmethod
     def _to_confidence(prob_like: float) -> float:
         # prob_like is sigmoid(logit) or a normalized 0..1 score
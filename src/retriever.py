@@ -13,26 +13,20 @@ class DomainRetriever(BaseRetriever):
     threshold: float = 0.5
 
     def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.db.similarity_search(query, k=self.k, threshold=self.threshold, filter=self._domain_filter())
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return await self.db.asimilarity_search(query, k=self.k, threshold=self.threshold, filter=self._domain_filter())
+
+    def _domain_filter(self):
         domains = self.router.route()  # 👈 user-selected domains
 
         if DOMAIN.ALL.value in domains:
-            retriever = self.db.db.as_retriever(search_type="similarity_score_threshold", search_kwargs={"k":self.k, "score_threshold": self.threshold})
-            return retriever.invoke(query)
+            return None
         
-        results: List[Document] = []
-        for domain in domains:
-            print(f"Searching in domain: {domain}")
-            retriever = self.db.db.as_retriever(search_type="similarity_score_threshold", search_kwargs={"k":self.k, "score_threshold": self.threshold, "filter":{"domain": domain}})
-            results.extend(retriever.invoke(query))
-
-        # dedup
-        seen, dedup = set(), []
-        for doc in results:
-            key = doc.metadata.get("id")
-            if key not in seen:
-                seen.add(key)
-                dedup.append(doc)
-        return dedup
+        # One vector query for every routed domain instead of one search per domain
+        print(f"Searching in domains: {', '.join(domains)}")
+        return {"domain": domains[0]} if len(domains) == 1 else {"domain": {"$in": list(domains)}}
     
 
 class BasicRetriever(BaseRetriever):
@@ -41,5 +35,7 @@ class BasicRetriever(BaseRetriever):
     threshold: float = 0.5
 
     def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
-        retriever = self.db.db.as_retriever(search_type="similarity_score_threshold", search_kwargs={"k":self.k, "score_threshold": self.threshold})
-        return retriever.invoke(query)
\ No newline at end of file
+        return self.db.similarity_search(query, k=self.k, threshold=self.threshold)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return await self.db.asimilarity_search(query, k=self.k, threshold=self.threshold)
\ No newline at end of file
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from util import source_key
+
+
+class SourceRegistry:
+    """
+    One row per ingested source, kept next to the vector store:
+    domain, the chunk IDs stored for it, a hash of its content and when it
+    was last ingested. Answers "what is loaded" and "which chunks belong to
+    this source" without scanning the collection's metadata.
+
+    Rows are keyed by util.source_key ("<domain>/<source>"), so files with
+    the same stem in different domains are separate sources.
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                domain TEXT,
+                content_hash TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                ingested_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(chunk_ids: Iterable[str]) -> str:
+        # chunk IDs are content hashes already, so hashing them identifies the source's content
+        return hashlib.sha256("\n".join(sorted(chunk_ids)).encode("utf-8")).hexdigest()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is None
+
+    def sources(self) -> List[str]:
+        # Source names (document stems); a name loaded in several domains appears once
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT source FROM sources")]
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT key FROM sources")]
+
+    def keys_for(self, source: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT key FROM sources WHERE source = ?", (source,))]
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sources WHERE key = ?", (key,)).fetchone() is not None
+
+    def get_chunk_ids(self, key: str) -> Optional[set[str]]:
+        # None when the source is unknown (as opposed to known with no chunks)
+        with self._lock:
+            row = self._conn.execute("SELECT chunk_ids FROM sources WHERE key = ?", (key,)).fetchone()
+        return set(json.loads(row[0])) if row else None
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, domain, content_hash, chunk_count, ingested_at FROM sources WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("source", "domain", "content_hash", "chunk_count", "ingested_at"), row))
+
+    def put_many(self, entries: Dict[str, Dict]):
+        """entries: key -> {"source": ..., "domain": ..., "chunk_ids": set[str]}"""
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, entry in entries.items():
+            ids = sorted(entry["chunk_ids"])
+            rows.append((key, entry["source"], entry.get("domain"), self.content_hash(ids), json.dumps(ids), len(ids), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sources "
+                "(key, source, domain, content_hash, chunk_ids, chunk_count, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def remove(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sources WHERE key = ?", (key,))
+            self._conn.commit()
+
+    @staticmethod
+    def group_by_source(ids: Iterable[str], metadatas: Iterable[Dict]) -> Dict[str, Dict]:
+        # (chunk ID, metadata) pairs -> put_many entries
+        entries: Dict[str, Dict] = {}
+        for chunk_id, meta in zip(ids, metadatas):
+            meta = meta or {}
+            key = source_key(meta)
+            if key is None:
+                continue
+            entry = entries.setdefault(key, {"source": meta["source"], "domain": meta.get("domain"), "chunk_ids": set()})
+            entry["chunk_ids"].add(chunk_id)
+        return entries
+
+    def backfill(self, ids: List[str], metadatas: List[Dict]):
+        # Rebuild the registry from a full (ids, metadatas) dump of the collection
+        entries = self.group_by_source(ids, metadatas)
+        self.put_many(entries)
+        return len(entries)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM sources")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            sources, chunks = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM sources"
+            ).fetchone()
+        return {"sources": sources, "chunks": chunks}
@@ -19,6 +19,7 @@ st.set_page_config(
 # ---------------- Session State ----------------
 if "rag" not in st.session_state:
     st.session_state.rag = Rag()
+    st.session_state.rag.warm_up_reranker()
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
@@ -176,6 +177,19 @@ def _render_retrieved_documents(query, sources, base_key: str, expanded: bool =
                 st.caption(f"Confidence: {conf_str} ({conf_label})")
                 _render_rag_content_block(src.get("content") or "")
 
+def _docs_to_sources(docs):
+    sources_payload = []
+    for d in docs:
+        meta = getattr(d, "metadata", {}) or {}
+        source = meta.get("source") or meta.get("file_path") or "Unknown source"
+        sources_payload.append({
+            "source": source,
+            "content": getattr(d, "page_content", ""),
+            "confidence": meta.get("confidence", 0),
+            "confidence_label": meta.get("confidence_label", "unknown")
+        })
+    return sources_payload
+
 # ---------------- Sidebar ----------------
 with st.sidebar:
     st.header("⚙️ Settings")
@@ -233,7 +247,8 @@ with st.sidebar:
     if st.button("🔄 Reload Documents"):
         with st.spinner("Loading documents..."):
             added = rag.load_documents()
-            st.success(f"Loaded {len(added)} new documents." if added else "No new documents found.")
+            count = added["upsert"]["items"] if added else 0
+            st.success(f"Loaded {count} new documents." if count else "No new documents found.")
 
     # NEW: Load only new docs
     if st.button("🆕 Load New Docs"):
@@ -247,7 +262,8 @@ with st.sidebar:
                         added = rag.load_documents(new_only=True)
                     except TypeError:
                         added = rag.load_documents()
-                st.success(f"Loaded {len(added)} new documents." if added else "No new documents found.")
+                count = added["upsert"]["items"] if added else 0
+                st.success(f"Loaded {count} new documents." if count else "No new documents found.")
             except Exception as e:
                 st.error(f"Failed: {e}")
 
@@ -316,31 +332,25 @@ with chat_tab:
                 st.markdown(prompt)
 
             with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    answer = "Error: Unknown"
-                    sources_payload = []
-                    try:
-                        response = rag.invoke(prompt)
-                        answer = response.get("answer", "No answer.")
-                        docs = response.get("docs", [])
-                        for d in docs:
-                            meta = getattr(d, "metadata", {}) or {}
-                            source = meta.get("source") or meta.get("file_path") or "Unknown source"
-                            confidence_score = meta.get("confidence", 0)
-                            confidence_label = meta.get("confidence_label", "unknown")
-
-                            content = getattr(d, "page_content", "")
-                            sources_payload.append({
-                                "source": source,
-                                "content": content,
-                                "confidence": confidence_score,
-                                "confidence_label": confidence_label
-                            })
-                    except Exception as e:
-                        answer = f"Error: {e}"
-
-                    st.markdown(answer)
-                    _render_retrieved_documents(prompt, sources_payload, base_key=f"live_{len(st.session_state.messages)}")
+                answer = ""
+                sources_payload = []
+                answer_placeholder = st.empty()
+                docs_container = st.container()
+                answer_placeholder.markdown("_Thinking..._")
+                try:
+                    # Render docs as soon as retrieval finishes, then the answer token by token
+                    for chunk in rag.stream(prompt):
+                        if "docs" in chunk:
+                            sources_payload = _docs_to_sources(chunk["docs"] or [])
+                            with docs_container:
+                                _render_retrieved_documents(prompt, sources_payload, base_key=f"live_{len(st.session_state.messages)}")
+                        if chunk.get("answer"):
+                            answer += chunk["answer"]
+                            answer_placeholder.markdown(answer + "▌")
+                    answer = answer or "No answer."
+                except Exception as e:
+                    answer = f"Error: {e}"
+                answer_placeholder.markdown(answer)
 
         st.session_state.messages.append({
             "role": "assistant",
@@ -410,7 +420,8 @@ with upload_tab:
                         with st.spinner("Indexing..."):
                             try:
                                 added = _index_domain(d)
-                                st.success(f"Indexed {len(added)} new documents." if added else "No new documents to index.")
+                                count = added["upsert"]["items"] if added else 0
+                                st.success(f"Indexed {count} new documents." if count else "No new documents to index.")
                             except Exception as e:
                                 st.error(f"Indexing failed: {e}")
                 else:
@@ -1,5 +1,5 @@
 from langchain.load import dumps, loads
-from sentence_transformers import CrossEncoder
+from model_pool import cross_encoder_pool
 from langchain_core.runnables import RunnableLambda
 from pathlib import Path
 def split_queries(queries : str):
@@ -28,53 +28,79 @@ def get_unique_union(documents: list[list], by_content_only=True):
         # Return
         return [loads(doc) for doc in unique_docs]
     
+def get_unique_union_by_id(documents: list[list]):
+    """ Unique union of retrieved docs keyed by chunk ID (content as fallback), first hit wins """
+    seen = set()
+    unique_docs = []
+    for sublist in documents:
+        for doc in sublist:
+            key = doc.metadata.get("id") or doc.page_content
+            if key not in seen:
+                seen.add(key)
+                unique_docs.append(doc)
+    return unique_docs
+    
+def source_key(metadata: dict) -> str | None:
+    """ Identity of a document in the index: "<domain>/<source>", so same-stem files in different domains stay apart """
+    source = metadata.get("source")
+    if source is None:
+        return None
+    domain = metadata.get("domain")
+    return f"{domain}/{source}" if domain else source
+
 def limit_docs(documents: list, limit=4):
     """ Limit number of documents """
     return documents[:limit]
     
-def reciprocal_rank_fusion(results: list[list], k=60):
+RRF_K = 60
+
+def reciprocal_rank_fusion(results: list[list], k=RRF_K):
     """ Reciprocal_rank_fusion that takes multiple lists of ranked documents 
-        and an optional parameter k used in the RRF formula """
-    
-    # Initialize a dictionary to hold fused scores for each unique document
-    fused_scores = {}
+        and an optional parameter k used in the RRF formula.
+        Documents are keyed by chunk ID (content as fallback) and scores are
+        accumulated in a flat list, so nothing is serialized. """
+    index = {}      # chunk key -> position in docs / scores
+    docs = []
+    scores = []
 
-    # Iterate through each list of ranked documents
-    for docs in results:
-        # Iterate through each document in the list, with its rank (position in the list)
-        for rank, doc in enumerate(docs):
-            # Convert the document to a string format to use as a key (assumes documents can be serialized to JSON)
-            doc_str = dumps(doc)
-            # If the document is not yet in the fused_scores dictionary, add it with an initial score of 0
-            if doc_str not in fused_scores:
-                fused_scores[doc_str] = 0
-            # Retrieve the current score of the document, if any
-            previous_score = fused_scores[doc_str]
-            # Update the score of the document using the RRF formula: 1 / (rank + k)
-            fused_scores[doc_str] += 1 / (rank + k)
+    for ranked in results:
+        for rank, doc in enumerate(ranked):
+            key = doc.metadata.get("id") or doc.page_content
+            i = index.get(key)
+            if i is None:
+                i = len(docs)
+                index[key] = i
+                docs.append(doc)
+                scores.append(0.0)
+            # RRF formula: 1 / (rank + k)
+            scores[i] += 1.0 / (rank + k)
 
-    # Sort the documents based on their fused scores in descending order to get the final reranked results
-    reranked_results = [
-        (loads(doc), score)
-        for doc, score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
-    ]
+    order = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
 
     # Return the reranked results as a list of tuples, each containing the document and its fused score
-    return reranked_results
+    return [(docs[i], scores[i]) for i in order]
+
+def confidence_label(point: float) -> str:
+    """ 0..1 confidence -> the high / medium / low label shown in the CLI and UI """
+    return "high" if point >= 0.80 else "medium" if point >= 0.60 else "low"
 
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
 def rerank_docs(top_n=5, model="cross-encoder/ms-marco-MiniLM-L-6-v2"):
-    ce = CrossEncoder(model)
+    ce = cross_encoder_pool.get(model)
     def _fn(response):
         q = response["question"]; docs = response["docs"] or []
         if not docs: return []
-        scores = ce.predict([(q, d.page_content) for d in docs])
+        scores = ce.score([(q, d.page_content) for d in docs])
         reranked = [d for d, _ in sorted(zip(docs, scores), key=lambda z: z[1], reverse=True)]
         return reranked[:top_n]
     return RunnableLambda(_fn)
 
+def build_key_tokens(keys):
+    """ Normalized util.source_key values ("<domain>/<source>") for loaded/unloaded checks """
+    return {str(k).replace(" ", "_").lower() for k in keys if k}
+
 def build_match_tokens(values):
     tokens = set()
     for value in values: